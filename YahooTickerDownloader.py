@@ -1,37 +1,186 @@
 #!/usr/bin/env python
 
-import pickle
-from time import sleep
+from time import sleep, time
+from threading import Thread
 import argparse
 import io
+import json
+import os
+import signal
 
 from ytd import SimpleSymbolDownloader
-from ytd.downloader.GenericDownloader import GenericDownloader
+import ytd.downloader
+from ytd.downloader import downloader_class
+from ytd.Journal import Journal
+from ytd.SqliteStore import SqliteStore
+from ytd.Refresher import Refresher
+from ytd.FrontierPruner import FrontierPruner
+from ytd.QueryStats import QueryStats
+from ytd.Frontier import SpillFrontier, YieldFrontier
+from ytd.ConnectionManager import parse_route
+from ytd.ResponseCache import ResponseCache
+from ytd.SnapshotDiff import SnapshotDiff, snapshot_rows, ADDED, REMOVED, MODIFIED
+from ytd import Profiler
+from ytd.exporter.CsvExporter import CsvExporter
+from ytd.exporter.JsonExporter import JsonExporter
+from ytd.exporter.NdjsonExporter import NdjsonExporter
+from ytd.exporter.XlsxExporter import XlsxExporter
+from ytd.exporter.YamlExporter import YamlExporter
+from ytd.exporter.IndexExporter import IndexExporter
 from ytd.compat import text
 from ytd.compat import csv
-from ytd.compat import robotparser
-
-import tablib
+from ytd.compat import is_py3
 
 import sys
 
 user_agent = SimpleSymbolDownloader.user_agent
 
-options = {
-    "generic": GenericDownloader()
+# How long the robots.txt answer in <type>.robots is used
+robots_ttl = 24 * 3600
+
+stores = {}
+
+exporters = {
+    "csv": CsvExporter,
+    "json": JsonExporter,
+    "ndjson": NdjsonExporter,
+    "xlsx": XlsxExporter,
+    "yaml": YamlExporter,
+    "index": IndexExporter,
 }
 
+# Filled in when they are used, they need pyarrow
+columnar_exporters = {}
+
+def openStore(tickerType, storeType="journal"):
+    # Where the download state is kept, the first call decides
+    if tickerType not in stores:
+        if storeType == "sqlite":
+            stores[tickerType] = SqliteStore(tickerType)
+        else:
+            stores[tickerType] = Journal(tickerType)
+    return stores[tickerType]
+
 def loadDownloader(tickerType):
-    downloader = options[tickerType]
-    with open(tickerType + ".pickle", "rb") as f:
-        downloader_data = pickle.load(f)
-        downloader.restore_state(downloader_data)
-        return downloader
+    downloader = downloader_class(tickerType)()
+    return openStore(tickerType).load(downloader)
 
 def saveDownloader(downloader, tickerType):
-    downloader_data = downloader.save_state()
-    with open(tickerType + ".pickle", "wb") as f:
-        pickle.dump(downloader_data, file=f, protocol=pickle.HIGHEST_PROTOCOL)
+    # Saves everything, even in the middle of a batch
+    start = time()
+    openStore(tickerType).compact(downloader)
+    downloader.metrics.observe("checkpoint_seconds", time() - start)
+
+def checkpointDownloader(downloader, tickerType):
+    # Only saves what the last batch changed
+    start = time()
+    openStore(tickerType).append(downloader)
+    downloader.metrics.observe("checkpoint_seconds", time() - start)
+
+def robotsAllowed(tickerType, protocol, host):
+    # The answer is kept for a day, a resume does not wait for robots.txt
+    url = protocol + '://' + host + '/robots.txt'
+    path = tickerType + '.robots'
+    try:
+        with io.open(path, encoding='utf-8') as f:
+            cached = json.load(f)
+        if cached['url'] == url and 0 <= time() - cached['checked'] < robots_ttl:
+            return cached['allowed']
+    except (IOError, OSError, ValueError, KeyError):
+        pass
+
+    # It imports most of urllib
+    if is_py3:
+        from urllib import robotparser
+    else:
+        import robotparser
+    rp = robotparser.RobotFileParser()
+    rp.set_url(url)
+    rp.read()
+    allowed = rp.can_fetch(user_agent, protocol + '://' + host + SimpleSymbolDownloader.search_path)
+    with io.open(path, 'w', encoding='utf-8') as f:
+        f.write(text(json.dumps({ 'url': url, 'allowed': allowed, 'checked': time() })))
+    return allowed
+
+def openDownloader(tickerType, args):
+    # Loads or starts the download of one type, with what the arguments change about it
+    if args.store != "sqlite" and os.path.exists(tickerType + ".sqlite"):
+        # Its partial query tree can not be turned back into a snapshot
+        print("Error: the " + tickerType + " download is kept in " + tickerType + ".sqlite, resume it"
+              " with --store sqlite or remove it to start over")
+        exit(1)
+    importing = (args.store == "sqlite" and os.path.exists(tickerType + ".pickle")
+                 and not os.path.exists(tickerType + ".sqlite"))
+    openStore(tickerType, args.store)
+    if importing:
+        print("Importing the " + tickerType + " download of " + tickerType + ".pickle into " + tickerType + ".sqlite")
+        downloader = Journal(tickerType).load(downloader_class(tickerType)())
+        saveDownloader(downloader, tickerType)
+    print("Checking if we can resume a old " + tickerType + " download session")
+    try:
+        downloader = loadDownloader(tickerType)
+        print("Downloader found on disk, resuming")
+    except:
+        print("No old downloader found on disk")
+        print("Starting a new session")
+        downloader = downloader_class(tickerType)()
+
+    if args.prune and downloader.pruner is None:
+        downloader.pruner = FrontierPruner()
+        downloader.pruner.rebuild(downloader.getCollectedSymbols())
+        # The journal can only be replayed on a snapshot that prunes as well
+        saveDownloader(downloader, tickerType)
+
+    if args.stats and downloader.stats is None:
+        downloader.stats = QueryStats(tickerType + ".stats.pickle")
+        downloader.stats.seed(downloader)
+        # The journal can only be replayed on a snapshot with the same policies
+        saveDownloader(downloader, tickerType)
+
+    if args.frontier == "yield" and not isinstance(downloader.queries, YieldFrontier):
+        if isinstance(downloader.queries, SpillFrontier):
+            print("Error: --frontier yield does not work with a download that was started with --frontier-window")
+            exit(1)
+        downloader.setFrontier(YieldFrontier())
+        # The journal can only be replayed on a snapshot with the same frontier
+        saveDownloader(downloader, tickerType)
+
+    if args.frontier_window is not None:
+        if isinstance(downloader.queries, YieldFrontier):
+            print("Error: --frontier-window does not work with --frontier yield")
+            exit(1)
+        if isinstance(downloader.queries, SpillFrontier):
+            downloader.queries.window = args.frontier_window
+        else:
+            frontier = SpillFrontier(tickerType + ".frontier", args.frontier_window,
+                                     stage1=downloader.queries.stage1)
+            # Nothing refers to what an earlier download left in them
+            frontier.clear()
+            downloader.setFrontier(frontier)
+            saveDownloader(downloader, tickerType)
+
+    if args.host:
+        # Otherwise every type keeps its own
+        downloader.host = args.host
+    downloader.quiet = args.quiet
+    if args.cache and not args.export:
+        downloader.cache = ResponseCache(tickerType, args.cache_ttl * 3600, int(args.cache_size * 1024 * 1024))
+    return downloader
+
+def profileOnSignal(path, seconds=10):
+    # kill -USR1 <pid> samples what the threads are doing for a while
+    def sample():
+        profile = Profiler.sample(seconds)
+        with io.open(path, "w", encoding="utf-8") as f:
+            f.write(text(profile))
+        print("Wrote a profile of " + str(seconds) + " seconds to " + path)
+
+    def handler(signum, frame):
+        t = Thread(target=sample)
+        t.daemon = True
+        t.start()
+
+    signal.signal(signal.SIGUSR1, handler)
 
 def print_symbol(symbol):
     try:
@@ -39,35 +188,218 @@ def print_symbol(symbol):
     except:
         print (" Could not display some ticker symbols due to char encoding")
 
-def downloadEverything(downloader, tickerType, insecure, sleeptime, pandantic):
-    def status_print(symbols):
-        print("Got " + str(len(symbols)) + " downloaded " + downloader.type + " symbols:")
-        if len(symbols) == 0:
-            pass
-        elif len(symbols) <= 4:
-            for s in symbols:
-                print_symbol(s)
-        else:
-            print_symbol(symbols[0])
-            print_symbol(symbols[1])
-            print ("  etc ...")
-            print_symbol(symbols[-1])
-        downloader.printProgress()
-
-    loop = 0
-    while not downloader.isDone():
-        downloader.nextRequest(status_print, insecure, pandantic)
-
-        # Save download state occasionally.
-        # We do this in case this long running is suddenly interrupted.
-        print ("Saving downloader to disk...")
-        saveDownloader(downloader, tickerType)
-        print ("Downloader successfully saved.")
-        print ("")
+def downloadEverything(downloaders, insecure, sleeptime, pandantic):
+    # (downloader, tickerType) pairs that share one engine, they take
+    #  turns with a batch each (See SymbolDownloader.shareEngine)
+    def status_printer(downloader):
+        def status_print(symbols):
+            print("Got " + str(len(symbols)) + " downloaded " + downloader.type + " symbols:")
+            if len(symbols) == 0:
+                pass
+            elif len(symbols) <= 4:
+                for s in symbols:
+                    print_symbol(s)
+            else:
+                print_symbol(symbols[0])
+                print_symbol(symbols[1])
+                print ("  etc ...")
+                print_symbol(symbols[-1])
+            downloader.printProgress()
+        return status_print
 
-        if not downloader.isDone():
+    while True:
+        downloading = [ (downloader, tickerType) for (downloader, tickerType) in downloaders
+                        if not downloader.isDone() ]
+        if not downloading:
+            break
+        for (downloader, tickerType) in downloading:
+            downloader.nextRequest(status_printer(downloader), insecure, pandantic)
+            if downloader.quiet:
+                # Only once per batch instead of for every request
+                downloader.printProgress()
+
+            # Save download state occasionally.
+            # We do this in case this long running is suddenly interrupted.
+            print ("Saving downloader to disk...")
+            checkpointDownloader(downloader, tickerType)
+            print ("Downloader successfully saved.")
+            print ("")
+
+        if any(not downloader.isDone() for (downloader, tickerType) in downloaders):
             sleep(sleeptime)  # So we don't overload the server.
 
+def downloadShards(downloader_class, tickerType, args, authkey):
+    from multiprocessing import Process
+    from ytd import ShardCoordinator
+
+    coordinator = ShardCoordinator.ShardCoordinator(tickerType, ShardCoordinator.shard_prefixes(args.shard_depth))
+    address = ShardCoordinator.parse_address(args.coordinator)
+    ShardCoordinator.serve(coordinator, address, authkey)
+    print("Coordinator listening on " + args.coordinator)
+    print(coordinator.status())
+
+    local_address = ('127.0.0.1' if address[0] in ('', '0.0.0.0') else address[0], address[1])
+    def start_worker():
+        p = Process(target=ShardCoordinator.run_worker,
+                    args=(local_address, authkey, downloader_class, tickerType, workerOptions(args)))
+        p.daemon = True
+        p.start()
+        return p
+    workers = [ start_worker() for x in range(args.workers) ]
+
+    # Local workers that exited with an error are started again, unless
+    # they keep doing that without finishing a shard
+    restarts = 0
+    completed = len(coordinator.completed)
+    waited = 0
+    while not coordinator.finished.wait(5):
+        if len(coordinator.completed) > completed:
+            (restarts, completed) = (0, len(coordinator.completed))
+        for (i, p) in enumerate(workers):
+            if p.is_alive() or coordinator.finished.is_set():
+                continue
+            if restarts >= max(3, args.workers):
+                print("Error: the local workers keep failing, stopping. Run this again to continue with the shards that are left")
+                exit(1)
+            print("A local worker exited with code " + str(p.exitcode) + ", starting another")
+            coordinator.abandon(ShardCoordinator.worker_name(p.pid))
+            restarts += 1
+            workers[i] = start_worker()
+        waited += 5
+        if waited % 60 == 0:
+            print(coordinator.status())
+    for p in workers:
+        p.join()
+
+    print("All shards are done, merging them")
+    downloader = coordinator.merge(downloader_class)
+    print ("Saving downloader to disk...")
+    saveDownloader(downloader, tickerType)
+    print ("Downloader successfully saved.")
+    print ("")
+    return downloader
+
+def workerOptions(args):
+    # What the shards are crawled with, see ShardCoordinator.run_worker
+    return {
+        'insecure': args.insecure,
+        'rate': args.rate,
+        'max_rate': args.max_rate,
+        'host': args.host,
+        'routes': args.route,
+        'quiet': args.quiet,
+        'engine': args.engine,
+        'concurrency': args.concurrency,
+        'prune': args.prune,
+        'cache': args.cache,
+        'cache_ttl': args.cache_ttl * 3600,
+        'cache_size': int(args.cache_size * 1024 * 1024),
+    }
+
+def refreshDownloader(downloader, tickerType, budget, insecure):
+    refresher = Refresher(tickerType, downloader)
+    changes = refresher.run(budget, insecure)
+    print("Refreshed with " + str(refresher.requests) + " requests, found " + str(len(changes)) + " changes:")
+    for (change, ticker, name, exchange, previous) in changes:
+        print(" " + change + " " + ticker + ("" if previous is None else " (was " + previous + ")"))
+
+    with io.open(downloader.type + '.changes.csv', 'w', encoding='utf-8') as f:
+        f.write(u"Change,Ticker,Name,Exchange,Previous\n")
+        writer = csv.writer(f)
+        for row in changes:
+            writer.writerow([text(y) if not y is None else u"" for y in row])
+
+    print ("Saving downloader to disk...")
+    saveDownloader(downloader, tickerType)
+    refresher.save()
+    print ("Downloader successfully saved.")
+    print ("")
+
+def verifyPruning(downloader, budget, insecure):
+    (checked, missed) = downloader.pruner.verify(downloader, budget, insecure)
+    deferred = len(downloader.pruner.deferred)
+    print("Checked " + str(checked) + " of " + str(deferred) + " deferred queries, they found "
+          + str(len(missed)) + " symbols the download did not:")
+    for symbol in sorted(missed.values(), key=lambda symbol: symbol.ticker):
+        print_symbol(symbol)
+    if checked > 0:
+        # Deferred queries can find the same symbols, so this is an upper bound
+        estimate = len(missed) * deferred // checked
+        print("Pruning lost at most about " + str(estimate) + " symbols, "
+              + str(round(100.0 * estimate / max(1, len(downloader.symbols) + estimate), 2)) + "% of all")
+    print("")
+
+def writeRows(path, formats, headers, fields, rows, partition=False):
+    # All formats are written in a single pass over the rows,
+    # no format keeps the rows in memory
+    writers = []
+    for format in formats:
+        try:
+            if format in columnar_exporters:
+                writer = columnar_exporters[format](path + '.' + format, fields,
+                                                    "exchange" if partition else None)
+            else:
+                writer = exporters[format](path + '.' + format, headers)
+            writers.append((format, writer))
+        except Exception as ex:
+            print("Could not export ." + format + ": " + str(ex))
+
+    for row in rows:
+        for (format, writer) in list(writers):
+            try:
+                writer.writeRow(row)
+            except Exception as ex:
+                print("Could not export ." + format + ": " + str(ex))
+                writers.remove((format, writer))
+
+    for (format, writer) in writers:
+        try:
+            writer.close()
+        except Exception as ex:
+            print("Could not export ." + format + ": " + str(ex))
+
+def exportSymbols(downloader, formats, exchange=None, partition=False):
+    rows = ( symbol.getRow() for symbol in downloader.getCollectedSymbols()
+             if exchange is None or symbol.exchange == exchange )
+    writeRows(downloader.type, formats, downloader.getRowHeader(), downloader.getRowFields(), rows, partition)
+
+def diffSymbols(downloader, snapshot, formats):
+    diff = SnapshotDiff(snapshot_rows(snapshot, type(downloader)))
+    rows = ( [ change ] + row for (change, row) in
+             diff.changes(symbol.getRow() for symbol in downloader.getCollectedSymbols()) )
+    writeRows(downloader.type + '.diff', formats, ["Change"] + downloader.getRowHeader(),
+              ["change"] + downloader.getRowFields(), rows)
+    print("Compared with " + snapshot + ": " + str(diff.counts[ADDED]) + " added, "
+          + str(diff.counts[REMOVED]) + " removed, " + str(diff.counts[MODIFIED]) + " modified, "
+          + str(diff.unchanged) + " unchanged")
+
+def serveLookups(tickerTypes, address):
+    from ytd.LookupServer import LookupServer, parse_address
+    from ytd.SymbolIndex import SymbolIndex
+
+    indexes = {}
+    for tickerType in tickerTypes:
+        try:
+            indexes[tickerType] = SymbolIndex(tickerType + ".index")
+        except (IOError, ValueError):
+            print("Error: there is no " + tickerType + ".index to serve, export it with -f index first")
+            return 1
+    server = LookupServer(indexes)
+    try:
+        server.serve(parse_address(address))
+    except (IOError, OSError) as ex:
+        print("Error: can not serve on " + address + ": " + str(ex))
+        return 1
+    print("Serving lookups of " + ", ".join(str(len(index)) + " " + tickerType + " symbols"
+                                            for (tickerType, index) in indexes.items()) + " on " + address)
+    try:
+        while True:
+            sleep(3600)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+
 def main():
     downloader = None
 
@@ -75,9 +407,37 @@ def main():
     parser.add_argument("-i", "--insecure", help="use HTTP instead of HTTPS", action="store_true")
     parser.add_argument("-e", "--export", help="export immediately without downloading (Only useful if you already downloaded something to the .pickle file)", action="store_true")
     parser.add_argument('-E', '--Exchange', help='Only export ticker symbols from this exchange (the filtering is done during the export phase)')
-    parser.add_argument('type', nargs='?', default='generic', help='The type to download, this can be: '+" ".join(list(options.keys())))
+    parser.add_argument('type', nargs='*', default=['generic'], help='The types to download, they share one connection pool and rate limit and take turns with a batch each. This can be: '+" ".join(sorted(ytd.downloader.downloaders.keys()))+' or a type a package registered')
+    parser.add_argument("-f", "--format", metavar="FORMAT", help="The formats to export to: csv, json, ndjson, xlsx, yaml, parquet, arrow and/or index, the file --serve looks symbols up in", nargs="+", choices=list(exporters.keys()) + ["parquet", "arrow"], default=["csv", "xlsx", "json", "yaml"])
+    parser.add_argument("--partition", help="Write the parquet and arrow exports as one file per exchange", action="store_true")
+    parser.add_argument("--diff", metavar="SNAPSHOT", help="Also write the symbols that were added, removed or modified since SNAPSHOT to <type>.diff.<format>. SNAPSHOT is an earlier .csv, .ndjson or .json export, or a copy of an earlier .pickle or .sqlite")
     parser.add_argument("-s", "--sleep", help="The time to sleep in seconds between requests", type=float, default=0)
+    parser.add_argument("-r", "--rate", help="The initial number of requests per second, it adapts to the server's responses", type=float, default=10)
+    parser.add_argument("--max-rate", help="Never send more than this number of requests per second", type=float, default=500)
+    parser.add_argument("--host", help="Download from this host[:port] instead, for example a fake server (python -m ytd.FakeServer)")
+    parser.add_argument("--route", metavar="SPEC", help="Spread the requests over this route, can be given more than once. SPEC is host=HOST[:PORT],proxy=URL,source=IP with every part optional. Unreachable routes are skipped for a while", action="append", default=[])
     parser.add_argument("-p", "--pandantic", help="Stop and warn the user if some rare assertion fails", action="store_true")
+    parser.add_argument("--store", help="Keep the download state in a .pickle file and journal, or in a .sqlite database that keeps it out of memory", choices=["journal", "sqlite"], default="journal")
+    parser.add_argument("--cache", help="Keep the search responses in <type>.cache.sqlite and reuse them in later runs", action="store_true")
+    parser.add_argument("--cache-ttl", metavar="HOURS", help="How long a cached response is used", type=float, default=168)
+    parser.add_argument("--cache-size", metavar="MB", help="Drop the oldest cached responses beyond this size", type=float, default=1024)
+    parser.add_argument("--engine", help="The fetch engine to use, async requires aiohttp", choices=["threads", "async"], default="threads")
+    parser.add_argument("-c", "--concurrency", help="Maximum number of requests in flight when using the async engine", type=int, default=500)
+    parser.add_argument("--coordinator", metavar="HOST:PORT", help="Split the download into shards by prefix and hand them out to workers listening on this address")
+    parser.add_argument("--workers", help="The number of local worker processes the coordinator starts", type=int, default=0)
+    parser.add_argument("--worker", metavar="HOST:PORT", help="Download shards handed out by the coordinator at this address")
+    parser.add_argument("--shard-depth", help="The length of the prefixes the coordinator splits the download on", type=int, default=1)
+    parser.add_argument("--prune", help="Skip child queries that are unlikely to find new symbols, a download started with this keeps pruning", action="store_true")
+    parser.add_argument("--stats", help="Learn which result counts to narrow and which characters to leave out at every query length from the earlier crawls in <type>.stats.pickle, and add this crawl to it once it is done. A download started with this keeps it", action="store_true")
+    parser.add_argument("--frontier", help="The order to fetch queries in: staged goes breadth first and then depth first, yield fetches the queries most likely to find new symbols first. A download started with yield keeps it", choices=["staged", "yield"], default="staged")
+    parser.add_argument("--frontier-window", metavar="QUERIES", help="Keep at most this many of the queries to fetch in memory and the others in <type>.frontier, a download started with this keeps it", type=int)
+    parser.add_argument("--verify-pruning", metavar="QUERIES", help="Fetch up to this many of the queries pruning skipped and report the symbols they find", type=int)
+    parser.add_argument("--refresh", metavar="QUERIES", help="Re-check up to this many queries of a finished download and write what changed to <type>.changes.csv", type=int)
+    parser.add_argument("--authkey", help="Secret shared by the coordinator and its workers, defaults to $YTD_AUTHKEY")
+    parser.add_argument("--serve", metavar="ADDRESS", help="Do not download but answer symbol lookups over HTTP on HOST:PORT, or on a Unix socket at a path, from the <type>.index exports. They are reloaded when a new export replaces them")
+    parser.add_argument("-q", "--quiet", help="Only print the progress after every batch instead of every request", action="store_true")
+    parser.add_argument("--metrics-port", metavar="PORT", help="Serve metrics in the Prometheus format on http://localhost:PORT/metrics", type=int)
+    parser.add_argument("--metrics-file", metavar="PATH", help="Write the metrics as JSON to this file every 10 seconds")
 
     args = parser.parse_args()
 
@@ -88,46 +448,132 @@ def main():
     if args.export:
         print("Exporting pickle file")
 
-    tickerType = args.type = args.type.lower()
-
-    print("Checking if we can resume a old download session")
-    try:
-        downloader = loadDownloader(tickerType)
-        print("Downloader found on disk, resuming")
-    except:
-        print("No old downloader found on disk")
-        print("Starting a new session")
-        if tickerType not in options:
+    tickerTypes = []
+    for tickerType in args.type:
+        if tickerType.lower() not in tickerTypes:
+            tickerTypes.append(tickerType.lower())
+    for tickerType in tickerTypes:
+        if downloader_class(tickerType) is None:
             print("Error: " + tickerType + " is not a valid type option. See --help")
             exit(1)
-        else:
-            downloader = options[tickerType]
+    if args.serve:
+        return serveLookups(tickerTypes, args.serve)
+    if len(tickerTypes) > 1 and (args.worker or args.coordinator or args.refresh
+                                 or args.verify_pruning or args.diff):
+        print("Error: --worker, --coordinator, --refresh, --verify-pruning and --diff work with one type at a time")
+        exit(1)
+
+    if (args.worker or args.coordinator) and (args.stats or args.frontier == "yield"
+                                              or args.frontier_window is not None):
+        # Shards are crawled as downloads of their own
+        print("Error: --stats, --frontier yield and --frontier-window do not work with --worker and --coordinator")
+        exit(1)
+
+    downloaders = [ (openDownloader(tickerType, args), tickerType) for tickerType in tickerTypes ]
+    (downloader, tickerType) = downloaders[0]
+
+    if args.route:
+        try:
+            downloader.connections.routes = [ parse_route(spec) for spec in args.route ]
+        except ValueError as ex:
+            print("Error: " + str(ex) + ". See --help")
+            exit(1)
+    if args.metrics_port is not None:
+        downloader.metrics.serve("localhost", args.metrics_port)
+        print("Serving metrics on http://localhost:" + str(args.metrics_port) + "/metrics")
+    if args.metrics_file:
+        downloader.metrics.writeEvery(args.metrics_file)
+    if hasattr(signal, "SIGUSR1"):
+        profileOnSignal(tickerType + ".profile.txt")
+    downloader.rate_controller.rate = args.rate
+    downloader.rate_controller.max_rate = args.max_rate
+
+    if args.engine == "async" and not args.export:
+        try:
+            from ytd.AsyncEngine import AsyncEngine
+        except ImportError:
+            print("Error: the async engine requires aiohttp (pip install aiohttp)")
+            exit(1)
+        downloader.engine = AsyncEngine(downloader, args.concurrency)
+
+    for (other, otherType) in downloaders[1:]:
+        # One engine, connection pool and rate limit, so more types do not mean more requests
+        other.shareEngine(downloader)
+
+    if "parquet" in args.format or "arrow" in args.format:
+        try:
+            from ytd.exporter.ParquetExporter import ParquetExporter
+            from ytd.exporter.ArrowExporter import ArrowExporter
+        except ImportError:
+            print("Error: the parquet and arrow exports require pyarrow (pip install pyarrow)")
+            exit(1)
+        columnar_exporters["parquet"] = ParquetExporter
+        columnar_exporters["arrow"] = ArrowExporter
+
+    authkey = (args.authkey or os.environ.get("YTD_AUTHKEY") or "").encode("utf-8")
+    if args.worker and not authkey:
+        print("Error: --worker needs the --authkey of the coordinator")
+        exit(1)
+    if args.coordinator and not authkey:
+        # Only the local workers can know it
+        authkey = os.urandom(16)
 
-    rp = robotparser.RobotFileParser()
-    rp.set_url(protocol + '://finance.yahoo.com/robots.txt')
-    rp.read()
     try:
         if not args.export:
-            
-            if(not rp.can_fetch(user_agent, protocol + '://finance.yahoo.com/_finance_doubledown/api/resource/searchassist')):
-                print('Execution of script halted due to robots.txt')
-                return 1
-            
-            if not downloader.isDone():
-                print("Downloading " + downloader.type)
+            for (other, otherType) in downloaders:
+                if not robotsAllowed(otherType, protocol, other.host):
+                    print('Execution of script halted due to robots.txt')
+                    return 1
+
+            if args.verify_pruning:
+                if downloader.pruner is None:
+                    print("Error: --verify-pruning needs a download that was started with --prune")
+                    return 1
+                verifyPruning(downloader, args.verify_pruning, args.insecure)
+                return
+
+            if args.worker:
+                print("Downloading " + downloader.type + " shards for the coordinator at " + args.worker)
+                from ytd import ShardCoordinator
+                ShardCoordinator.run_worker(ShardCoordinator.parse_address(args.worker), authkey,
+                                            type(downloader), tickerType, workerOptions(args))
+                return
+            elif args.coordinator:
+                downloader = downloadShards(type(downloader), tickerType, args, authkey)
+                downloaders = [ (downloader, tickerType) ]
+            elif args.refresh:
+                if not downloader.isDone():
+                    print("Error: --refresh needs a finished download")
+                    return 1
+                if args.store == "sqlite":
+                    print("Error: --refresh needs the query tree of the journal store")
+                    return 1
+                print("Refreshing " + downloader.type)
                 print("")
-                downloadEverything(downloader, tickerType, args.insecure, args.sleep, args.pandantic)
-                print ("Saving downloader to disk...")
-                saveDownloader(downloader, tickerType)
-                print ("Downloader successfully saved.")
-                print ("")
+                refreshDownloader(downloader, tickerType, args.refresh, args.insecure)
             else:
-                print("The downloader has already finished downloading everything")
+                downloading = []
+                for (other, otherType) in downloaders:
+                    if other.isDone():
+                        print("The " + otherType + " downloader has already finished downloading everything")
+                    else:
+                        print("Downloading " + other.type)
+                        downloading.append((other, otherType))
                 print("")
+                downloadEverything(downloading, args.insecure, args.sleep, args.pandantic)
+                for (other, otherType) in downloading:
+                    if other.stats is not None and other.isDone():
+                        other.stats.merge(other)
+                        print(other.stats.report())
+                    print ("Saving downloader to disk...")
+                    saveDownloader(other, otherType)
+                    print ("Downloader successfully saved.")
+                    print ("")
 
     except Exception as ex:
         print("A exception occurred while downloading. Suspending downloader to disk")
-        saveDownloader(downloader, tickerType)
+        for (other, otherType) in downloaders:
+            saveDownloader(other, otherType)
         print("Successfully saved download state")
         print("Try removing {type}.pickle file if this error persists")
         print("Issues can be reported on https://github.com/Benny-/Yahoo-ticker-symbol-downloader/issues")
@@ -135,45 +581,33 @@ def main():
         raise
     except KeyboardInterrupt as ex:
         print("\nSuspending downloader to disk as .pickle file")
-        saveDownloader(downloader, tickerType)
+        for (other, otherType) in downloaders:
+            saveDownloader(other, otherType)
         raise
+    finally:
+        for (other, otherType) in downloaders:
+            if other.shared_with is None:
+                if other.engine is not None:
+                    other.engine.close()
+                other.connections.close()
+            if other.cache is not None:
+                other.cache.close()
+            if args.metrics_file and other is downloader:
+                other.metrics.writeJson(args.metrics_file)
+            other.metrics.close()
 
-    if downloader.isDone() or args.export:
-        print("Exporting "+downloader.type+" symbols")
-
-        data = tablib.Dataset()
-        data.headers = downloader.getRowHeader()
-
-        for symbol in downloader.getCollectedSymbols():
-            if(args.Exchange == None):
-                data.append(symbol.getRow())
-            elif (symbol.exchange == args.Exchange):
-                data.append(symbol.getRow())
-
-        with io.open(downloader.type + '.csv', 'w', encoding='utf-8') as f:
-            f.write(text.join(u',', data.headers) + '\n')
-            writer = csv.writer(f)
-            for i in range(0, len(data)):
-                row = [text(y) if not y is None else u"" for y in data[i]]
-                writer.writerow(row)
-
-        try:
-            with open(downloader.type + '.xlsx', 'wb') as f:
-                f.write(data.xlsx)
-        except:
-            print("Could not export .xlsx due to a internal error")
-
-        try:
-            with open(downloader.type + '.json', 'wb') as f:
-                f.write(data.json.encode('UTF-8'))
-        except:
-            print("Could not export .json due to a internal error")
-
-        try:
-            with open(downloader.type + '.yaml', 'wb') as f:
-                f.write(data.yaml.encode('UTF-8'))
-        except:
-            print("Could not export .yaml due to a internal error")
+    for (downloader, tickerType) in downloaders:
+        if downloader.isDone() or args.export:
+            if args.diff:
+                # Before the export, which can overwrite the snapshot
+                print("Comparing "+downloader.type+" symbols with " + args.diff)
+                try:
+                    diffSymbols(downloader, args.diff, args.format)
+                except (IOError, ValueError) as ex:
+                    print("Error: " + str(ex))
+                    return 1
+            print("Exporting "+downloader.type+" symbols")
+            exportSymbols(downloader, args.format, args.Exchange, args.partition)
 
 if __name__ == "__main__":
     main()
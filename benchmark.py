@@ -0,0 +1,197 @@
+#!/usr/bin/env python
+
+"""Downloads everything from a local fake server and reports how that went
+
+The crawl runs in its own process, so its peak memory is not mixed up with
+the fake server's. With --baseline the results are compared to an earlier
+--output and the exit status is 1 if any of them got worse by more than
+--tolerance.
+"""
+
+from time import time
+from multiprocessing import Process, Queue
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+
+try:
+    import resource
+except ImportError:
+    # Not on Windows
+    resource = None
+
+from ytd.compat import is_py3
+if is_py3:
+    from queue import Empty
+else:
+    from Queue import Empty
+from ytd.FakeServer import FakeServer, synthetic_universe, load_universe
+from ytd.downloader.GenericDownloader import GenericDownloader
+from ytd.FrontierPruner import FrontierPruner
+from ytd.Journal import Journal
+from ytd.SqliteStore import SqliteStore
+
+import YahooTickerDownloader
+
+# metric -> True if higher is better
+metrics = {
+    "requests_per_second": True,
+    "requests_per_symbol": False,
+    "coverage": True,
+    "crawl_time": False,
+    "checkpoint_time": False,
+    "export_time": False,
+    "peak_rss_mb": False,
+    "worker_utilization": True,
+}
+
+def crawl(config, results):
+    os.chdir(config["directory"])
+    sys.stdout = open(os.devnull, "w")
+
+    downloader = GenericDownloader()
+    downloader.host = config["host"]
+    downloader.rate_controller.rate = config["rate"]
+    downloader.rate_controller.max_rate = config["max_rate"]
+    if config["prune"]:
+        downloader.pruner = FrontierPruner()
+    if config["engine"] == "async":
+        from ytd.AsyncEngine import AsyncEngine
+        downloader.engine = AsyncEngine(downloader, config["concurrency"])
+    if config["store"] == "sqlite":
+        store = SqliteStore(downloader.type)
+    else:
+        store = Journal(downloader.type)
+
+    checkpoint_time = 0
+    start = time()
+    while not downloader.isDone():
+        downloader.nextRequest(lambda symbols: None, True)
+        checkpoint_start = time()
+        store.append(downloader)
+        checkpoint_time += time() - checkpoint_start
+    checkpoint_start = time()
+    store.compact(downloader)
+    checkpoint_time += time() - checkpoint_start
+    crawl_time = time() - start
+    slots = downloader.workers
+    if downloader.engine is not None:
+        slots = downloader.engine.concurrency
+        downloader.engine.close()
+
+    export_start = time()
+    YahooTickerDownloader.exportSymbols(downloader, config["formats"])
+    export_time = time() - export_start
+
+    results.put({
+        "symbols": len(downloader.symbols),
+        "queries": len(downloader.completed_queries),
+        "crawl_time": crawl_time,
+        "checkpoint_time": checkpoint_time,
+        "export_time": export_time,
+        # The share of the time the workers had a query
+        "worker_utilization": downloader.busy_seconds / (crawl_time * slots),
+        "peak_rss_mb": None if resource is None else
+            resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (1024.0 * 1024 if sys.platform == "darwin" else 1024.0),
+    })
+
+def run(args):
+    if args.universe.isdigit():
+        universe = synthetic_universe(int(args.universe), args.seed)
+    else:
+        universe = load_universe(args.universe)
+    server = FakeServer(universe, max_results=args.max_results, latency=args.latency,
+                        error_rate=args.error_rate, retry_after=0, seed=args.seed).start()
+
+    directory = tempfile.mkdtemp(prefix="ytd-benchmark-")
+    config = {
+        "directory": directory,
+        "host": server.address,
+        "rate": args.rate,
+        "max_rate": args.max_rate,
+        "prune": args.prune,
+        "engine": args.engine,
+        "concurrency": args.concurrency,
+        "store": args.store,
+        "formats": args.format,
+    }
+    results = Queue()
+    try:
+        p = Process(target=crawl, args=(config, results))
+        p.start()
+        while True:
+            try:
+                result = results.get(timeout=1)
+                break
+            except Empty:
+                if not p.is_alive():
+                    raise Exception("The download failed, see above")
+        p.join()
+    finally:
+        server.stop()
+        shutil.rmtree(directory)
+
+    fetch_time = result["crawl_time"] - result["checkpoint_time"]
+    result["universe"] = len(universe)
+    result["requests"] = server.requests
+    result["errors"] = server.errors
+    result["requests_per_second"] = server.requests / fetch_time if fetch_time > 0 else None
+    result["requests_per_symbol"] = server.requests / float(max(1, result["symbols"]))
+    result["coverage"] = result["symbols"] / float(max(1, len(universe)))
+    return result
+
+def compare(result, baseline, tolerance):
+    # Returns the metrics that got worse by more than tolerance
+    regressions = []
+    for metric, higher_is_better in metrics.items():
+        (new, old) = (result.get(metric), baseline.get(metric))
+        if new is None or old is None or old == 0:
+            continue
+        change = (new - old) / float(old)
+        if (change < -tolerance) if higher_is_better else (change > tolerance):
+            regressions.append((metric, old, new))
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark a complete download from a local fake server")
+    parser.add_argument("--universe", help="A .csv or .ndjson export to serve, or the number of made up symbols", default="10000")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--max-results", type=int, default=10)
+    parser.add_argument("--latency", help="Seconds every request takes", type=float, default=0)
+    parser.add_argument("--error-rate", help="The share of requests that fail with a 429 or 503", type=float, default=0)
+    parser.add_argument("-r", "--rate", type=float, default=1000)
+    parser.add_argument("--max-rate", type=float, default=10000)
+    parser.add_argument("--engine", choices=["threads", "async"], default="threads")
+    parser.add_argument("-c", "--concurrency", type=int, default=500)
+    parser.add_argument("--store", choices=["journal", "sqlite"], default="journal")
+    parser.add_argument("--prune", action="store_true")
+    parser.add_argument("-f", "--format", nargs="+", default=["csv", "xlsx", "json", "yaml"])
+    parser.add_argument("-o", "--output", help="Write the results to this .json file")
+    parser.add_argument("--baseline", help="Fail if the results are worse than the ones in this .json file")
+    parser.add_argument("--tolerance", help="How much worse than the baseline is still fine", type=float, default=0.1)
+    args = parser.parse_args()
+
+    result = run(args)
+    for key in sorted(result.keys()):
+        value = result[key]
+        print(key + ": " + (str(round(value, 3)) if isinstance(value, float) else str(value)))
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=4, sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(result, baseline, args.tolerance)
+        for (metric, old, new) in regressions:
+            print("Regression: " + metric + " went from " + str(round(old, 3)) + " to " + str(round(new, 3)))
+        if regressions:
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -16,9 +16,13 @@ setup(
     scripts = ['YahooTickerDownloader.py'],
     install_requires=[
         "requests >= 2.4.3",
-        "tablib >= 0.9.11",
         "backports.csv >= 1.0.4",
     ],
+    extras_require={
+        "async": ["aiohttp >= 3.0"],
+        "parquet": ["pyarrow >= 1.0"],
+        "fast": ["orjson >= 3.0"],
+    },
     classifiers=[
         "Operating System :: OS Independent",
         "Programming Language :: Python",
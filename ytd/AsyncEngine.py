@@ -0,0 +1,208 @@
+import asyncio
+import signal
+from time import time
+
+import aiohttp
+from yarl import URL
+
+from .compat import urlencode, json_loads
+from .SimpleSymbolDownloader import user_agent, search_params
+from .RateController import outcome_for_status, OK, FAILED
+
+class AsyncEngine:
+    """Fetches a downloader's queries on an asyncio event loop instead of worker threads
+
+    Responses are decoded and handed to the downloader's _apply_fetch from the event loop,
+    so the resulting symbols and query tree are the same as with the threaded engine.
+    Requests still in flight at the end of a batch continue in the next one.
+
+    Downloaders of other types can share it (See SymbolDownloader.shareEngine).
+    A response for another downloader than the one running a batch is kept
+    until that one runs its next batch, so it lands in its own journal.
+    """
+
+    def __init__(self, downloader, concurrency=500):
+        self.downloader = downloader
+        # Maximum number of requests in flight, the connection pool is sized to match
+        self.concurrency = concurrency
+        self.maxRetries = 10
+        self.rate_controller = downloader.rate_controller
+        self.rate_controller.max_concurrency = concurrency
+        self.loop = asyncio.new_event_loop()
+        # Route -> aiohttp.ClientSession, see ytd.ConnectionManager
+        self.sessions = {}
+        self.tasks = set()
+        # task -> the downloader it fetches for
+        self.owners = {}
+        # downloader -> responses for it that came in during another's batch
+        self.finished = {}
+        # The task running a batch, see run()
+        self.running = None
+        # How long cancelled requests get to finish
+        self.cancel_timeout = 5
+
+    def run(self, batch_size, downloader=None):
+        """Ctrl-C stops the batch between two results and raises KeyboardInterrupt here"""
+        self.running = self.loop.create_task(self._run(downloader or self.downloader, batch_size))
+        interrupted = []
+        def interrupt():
+            interrupted.append(True)
+            self.running.cancel()
+        try:
+            self.loop.add_signal_handler(signal.SIGINT, interrupt)
+            handled = True
+        except (ValueError, RuntimeError, NotImplementedError):
+            # Not the main thread, or not supported on this platform
+            handled = False
+        try:
+            self.loop.run_until_complete(self.running)
+        except asyncio.CancelledError:
+            if not interrupted:
+                raise
+        finally:
+            if handled:
+                self.loop.remove_signal_handler(signal.SIGINT)
+        if interrupted:
+            raise KeyboardInterrupt()
+
+    def close(self):
+        if self.running is not None and not self.running.done():
+            # Interrupted while the loop ran it anyway
+            self.running.cancel()
+            self.loop.run_until_complete(asyncio.wait([ self.running ], timeout=self.cancel_timeout))
+        if self.tasks:
+            self.loop.run_until_complete(self._cancel())
+        for session in self.sessions.values():
+            self.loop.run_until_complete(session.close())
+        self.sessions = {}
+        self.loop.close()
+
+    def _session(self, route):
+        session = self.sessions.get(route)
+        if session is None:
+            session = self.sessions[route] = self._open_session(route)
+        return session
+
+    def _open_session(self, route):
+        connector = aiohttp.TCPConnector(
+            limit=self.concurrency,
+            limit_per_host=self.concurrency,
+            ttl_dns_cache=300,
+            local_addr=(route.source, 0) if route.source else None,
+        )
+        timeout = aiohttp.ClientTimeout(sock_connect=12, sock_read=12)
+        return aiohttp.ClientSession(
+            connector=connector,
+            timeout=timeout,
+            headers={'User-agent': user_agent},
+        )
+
+    async def _run(self, downloader, batch_size):
+        processed = 0
+        for result in self.finished.pop(downloader, []):
+            downloader._apply_fetch(*result)
+            processed += 1
+        try:
+            while True:
+                for query in downloader._next_queries(self.concurrency - len(self.tasks)):
+                    task = asyncio.ensure_future(self._fetch_worker(downloader, query))
+                    self.tasks.add(task)
+                    self.owners[task] = downloader
+                if processed >= batch_size or downloader not in self.owners.values():
+                    return
+                (done, self.tasks) = await asyncio.wait(self.tasks, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    owner = self.owners.pop(task)
+                    if owner is downloader:
+                        downloader._apply_fetch(*task.result())
+                        processed += 1
+                    else:
+                        self.finished.setdefault(owner, []).append(task.result())
+        except:
+            await self._cancel()
+            raise
+
+    async def _cancel(self):
+        for task in self.tasks:
+            task.cancel()
+        if self.tasks:
+            (done, pending) = await asyncio.wait(self.tasks, timeout=self.cancel_timeout)
+            for task in done:
+                if not task.cancelled():
+                    # Nobody wants what it returned or raised anymore
+                    task.exception()
+        self.tasks = set()
+        self.owners = {}
+        self.finished = {}
+
+    async def _fetch(self, downloader, query_string, route):
+        url = (downloader._fetch_url(downloader.insecure, query_string, route.host)
+               + '?' + urlencode(search_params))
+        msg = "req " + url
+        # The url is already quoted the same way requests would send it
+        async with self._session(route).get(URL(url, encoded=True), proxy=route.proxy) as resp:
+            resp.raise_for_status()
+            body = await resp.read()
+        json = json_loads(body)
+        downloader._cache_response(query_string, body)
+        return [ json, msg ]
+
+    async def _acquire(self):
+        while True:
+            wait = self.rate_controller.try_acquire()
+            if wait == 0:
+                return
+            # None means we wait for a request in flight to finish
+            await asyncio.sleep(0.01 if wait is None else wait)
+
+    async def _fetch_worker(self, downloader, current_query):
+        # Returns what _apply_fetch needs, it is called by _run
+        started = time()
+        try:
+            cached = downloader._fetch_cached(current_query.query_string)
+            if cached is not None:
+                (json, msg) = cached
+            else:
+                (json, msg) = await self._fetch_with_retries(downloader, current_query.query_string)
+            return [ current_query, downloader._decode(json), msg ]
+        finally:
+            downloader._add_busy(time() - started)
+
+    async def _fetch_with_retries(self, downloader, query_string):
+        metrics = downloader.metrics
+        connections = downloader.connections
+        retryCount = 0
+        # Back-off is done by the shared rate controller
+        while True:
+            await self._acquire()
+            route = connections.choose()
+            start = time()
+            # Released however the request ends, cancelled ones too
+            (outcome, retry_after) = (FAILED, None)
+            try:
+                result = await self._fetch(downloader, query_string, route)
+                outcome = OK
+            except aiohttp.ClientResponseError as ex:
+                outcome = outcome_for_status(ex.status)
+                retry_after = ex.headers.get('Retry-After') if ex.headers else None
+                metrics.count("requests_total", status=ex.status)
+                connections.succeeded(route)
+                error = ex
+            except (aiohttp.ClientError, asyncio.TimeoutError) as ex:
+                outcome = outcome_for_status(None)
+                metrics.count("requests_total", status=type(ex).__name__)
+                downloader._route_failed(route)
+                error = ex
+            finally:
+                metrics.observe("request_seconds", time() - start)
+                self.rate_controller.release(outcome, retry_after)
+            if outcome == OK:
+                connections.succeeded(route)
+                metrics.count("requests_total", status=200)
+                return result
+            if outcome == FAILED or retryCount >= self.maxRetries:
+                # Other 4xx responses do not change by asking again
+                raise error
+            metrics.count("retries_total", error=type(error).__name__)
+            retryCount += 1
+            print("Retry attempt: " + str(retryCount) + " of " + str(self.maxRetries) + ".")
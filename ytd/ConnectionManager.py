@@ -0,0 +1,155 @@
+from threading import Lock
+from time import time
+
+class Route:
+    """One way to reach the search API
+
+    host is None for the downloader's own host. proxy is a proxy url and
+    source the local address to connect from, both optional.
+    """
+
+    def __init__(self, host=None, proxy=None, source=None):
+        self.host = host
+        self.proxy = proxy
+        self.source = source
+        # Failed connections in a row, and until when the route is skipped
+        self.failures = 0
+        self.down_until = 0
+        self.requests = 0
+        self.errors = 0
+
+    def name(self):
+        parts = []
+        if self.host:
+            parts.append("host=" + self.host)
+        if self.proxy:
+            parts.append("proxy=" + self.proxy)
+        if self.source:
+            parts.append("source=" + self.source)
+        return ",".join(parts) or "direct"
+
+def parse_route(spec):
+    """A Route from "host=H,proxy=URL,source=IP", every part is optional
+
+    Raises ValueError for anything else.
+    """
+    options = {}
+    for part in spec.split(","):
+        if not part.strip():
+            continue
+        (key, sep, value) = part.partition("=")
+        key = key.strip()
+        if not sep or key not in ("host", "proxy", "source") or key in options:
+            raise ValueError("Not a route: " + spec)
+        options[key] = value.strip()
+    return Route(**options)
+
+def _adapter(source, pool_size):
+    # requests is imported when the first session is made, so exporting
+    # or resuming without a download never pays for it
+    from requests.adapters import HTTPAdapter
+
+    class SourceAddressAdapter(HTTPAdapter):
+        """Connects from a given local address"""
+
+        def init_poolmanager(self, *args, **kwargs):
+            kwargs['source_address'] = (source, 0)
+            HTTPAdapter.init_poolmanager(self, *args, **kwargs)
+
+        def proxy_manager_for(self, proxy, **kwargs):
+            kwargs['source_address'] = (source, 0)
+            return HTTPAdapter.proxy_manager_for(self, proxy, **kwargs)
+
+    if source:
+        return SourceAddressAdapter(pool_connections=1, pool_maxsize=pool_size)
+    return HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+
+class ConnectionManager:
+    """Hands out a route for every request and keeps a session per route
+
+    A session keeps up to pool_size connections alive for as long as the
+    downloader lives, so they are reused from one batch to the next instead
+    of being thrown away once the default pool of 10 is full.
+
+    Requests take the healthy routes in turn. A route whose connection
+    fails max_failures times in a row is skipped for a while, twice as long
+    every time up to 5 minutes, and a response makes it healthy again. HTTP
+    errors and throttling are left to the rate controller, which every route
+    shares: more routes spread the requests, they do not add to the rate.
+    """
+
+    def __init__(self, routes=None, pool_size=100, max_failures=3):
+        self.routes = routes or [ Route() ]
+        self.pool_size = pool_size
+        self.max_failures = max_failures
+        self.lock = Lock()
+        self.next = 0
+        # Route -> requests.Session
+        self.sessions = {}
+
+    def choose(self):
+        """The route for the next request"""
+        now = time()
+        with self.lock:
+            for i in range(len(self.routes)):
+                route = self.routes[(self.next + i) % len(self.routes)]
+                if route.down_until <= now:
+                    self.next = (self.next + i + 1) % len(self.routes)
+                    route.requests += 1
+                    return route
+            # All are down, the one that comes back first is tried early
+            route = min(self.routes, key=lambda route: route.down_until)
+            route.requests += 1
+            return route
+
+    def send(self, route, request, timeout):
+        """Sends a prepared request on route"""
+        if route.proxy:
+            # Session.send does not apply session.proxies
+            return self._session(route).send(request, timeout=timeout,
+                                             proxies={ "http": route.proxy, "https": route.proxy })
+        return self._session(route).send(request, timeout=timeout)
+
+    def _session(self, route):
+        with self.lock:
+            session = self.sessions.get(route)
+            if session is None:
+                import requests
+                session = self.sessions[route] = requests.Session()
+                adapter = _adapter(route.source, self.pool_size)
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+            return session
+
+    def succeeded(self, route):
+        with self.lock:
+            route.failures = 0
+            route.down_until = 0
+
+    def failed(self, route):
+        """A request on route got no response at all, returns True if that took it down"""
+        with self.lock:
+            route.errors += 1
+            route.failures += 1
+            if route.failures >= self.max_failures:
+                route.down_until = time() + min(300, 5 * 2 ** min(route.failures - self.max_failures, 6))
+            return route.failures == self.max_failures
+
+    def healthy(self):
+        now = time()
+        return sum(1 for route in self.routes if route.down_until <= now)
+
+    def describe(self):
+        if len(self.routes) == 1:
+            return None
+        now = time()
+        return "Routes: " + "; ".join(
+            "%s %d requests, %d errors%s" % (route.name(), route.requests, route.errors,
+                                            ", down for %ds" % (route.down_until - now) if route.down_until > now else "")
+            for route in self.routes)
+
+    def close(self):
+        with self.lock:
+            for session in self.sessions.values():
+                session.close()
+            self.sessions = {}
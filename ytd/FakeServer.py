@@ -0,0 +1,193 @@
+import argparse
+import io
+import json
+import random
+import re
+from bisect import bisect_left
+from threading import Thread, Lock
+from time import sleep
+
+from .compat import is_py3, csv
+from .PrefixIndex import name_tokens
+from .SimpleSymbolDownloader import search_path
+if is_py3:
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+    from socketserver import ThreadingMixIn
+    from urllib.parse import unquote
+else:
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+    from SocketServer import ThreadingMixIn
+    from urllib import unquote
+
+exchanges = [ ("NYQ", "NYSE"), ("NMS", "NASDAQ"), ("PNK", "OTC Markets"), ("LSE", "London"),
+              ("GER", "XETRA"), ("TOR", "Toronto"), ("HKG", "Hong Kong"), ("PAR", "Paris") ]
+types = [ ("S", "Equity"), ("E", "ETF"), ("M", "Fund"), ("I", "Index"), ("F", "Futures") ]
+words = ("Alpha Beta Gamma Delta Omega Global United First National American Pacific Atlantic "
+         "Capital Energy Bio Tech Systems Holdings Group Resources Financial Industries Trust "
+         "Partners Mining Pharma Foods Motors Digital Networks Realty Bank Insurance").split()
+
+def synthetic_universe(size=10000, seed=0):
+    """size made up symbols in the format of the searchassist API"""
+    rng = random.Random(seed)
+    universe = {}
+    while len(universe) < size:
+        ticker = "".join(rng.choice("ABCDEFGHIJKLMNOPQRSTUVWXYZ") for x in range(rng.randint(1, 5)))
+        if rng.random() < 0.1:
+            ticker += rng.choice([ ".L", ".DE", ".TO", "-B", "=F", "1", "2" ])
+        (exch, exchDisp) = rng.choice(exchanges)
+        (type, typeDisp) = rng.choice(types)
+        universe[ticker] = {
+            'symbol': ticker,
+            'name': " ".join(rng.sample(words, rng.randint(1, 3))),
+            'exch': exch,
+            'exchDisp': exchDisp,
+            'type': type,
+            'typeDisp': typeDisp,
+        }
+    return list(universe.values())
+
+def load_universe(path):
+    """The symbols of an earlier .csv or .ndjson export"""
+    universe = []
+    with io.open(path, encoding='utf-8') as f:
+        if path.endswith(".ndjson"):
+            rows = ( json.loads(line) for line in f if line.strip() )
+        else:
+            rows = csv.DictReader(f)
+        for row in rows:
+            universe.append({
+                'symbol': row['Ticker'],
+                'name': row.get('Name') or None,
+                'exch': row.get('Exchange') or None,
+                'exchDisp': row.get('exchangeDisplay') or None,
+                'type': row.get('Type') or None,
+                'typeDisp': row.get('TypeDisplay') or None,
+            })
+    return universe
+
+class FakeServer:
+    """Serves searchassist and robots.txt from a fixed universe of symbols
+
+    A search term matches a symbol if the ticker, or a word of the name,
+    starts with it. The exact ticker comes first, then the tickers and then
+    the names that start with the term, at most max_results of them. Every
+    request can be delayed by latency seconds, and error_rate of them get
+    one of error_statuses instead, with Retry-After: retry_after on a 429.
+    """
+
+    def __init__(self, universe, host='127.0.0.1', port=0, max_results=10, latency=0,
+                 error_rate=0, error_statuses=(429, 503), retry_after=1, seed=0):
+        self.universe = list(universe)
+        self.max_results = max_results
+        self.latency = latency
+        self.error_rate = error_rate
+        self.error_statuses = error_statuses
+        self.retry_after = retry_after
+        self.random = random.Random(seed)
+        self.lock = Lock()
+        self.requests = 0
+        self.errors = 0
+        self.tickers = sorted((item['symbol'].upper(), i) for i, item in enumerate(self.universe))
+        self.tokens = sorted((token, i) for i, item in enumerate(self.universe)
+                             for token in set(name_tokens(item['name'])))
+
+        fake = self
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                fake._handle(self)
+
+        class Server(ThreadingMixIn, HTTPServer):
+            daemon_threads = True
+            # Clients hanging up early are not interesting
+            def handle_error(self, request, client_address):
+                pass
+
+        self.server = Server((host, port), Handler)
+        self.address = host + ":" + str(self.server.server_address[1])
+        self.thread = None
+
+    def start(self):
+        self.thread = Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def search(self, term):
+        term = term.upper()
+        found = []
+        seen = set()
+        for keys in (self.tickers, self.tokens):
+            i = bisect_left(keys, (term,))
+            while i < len(keys) and keys[i][0].startswith(term) and len(found) < self.max_results:
+                if keys[i][1] not in seen:
+                    seen.add(keys[i][1])
+                    found.append(self.universe[keys[i][1]])
+                i += 1
+        return found
+
+    def _handle(self, request):
+        if request.path == "/robots.txt":
+            self._reply(request, 200, "text/plain", b"User-agent: *\nAllow: /\n")
+            return
+        if not request.path.startswith(search_path):
+            self._reply(request, 404, "text/plain", b"Not found\n")
+            return
+
+        with self.lock:
+            self.requests += 1
+            error = self.random.random() < self.error_rate
+            status = self.random.choice(self.error_statuses) if error else 200
+            if error:
+                self.errors += 1
+        if self.latency:
+            sleep(self.latency)
+        if status != 200:
+            headers = { 'Retry-After': str(self.retry_after) } if status == 429 else {}
+            self._reply(request, status, "text/plain", b"Injected error\n", headers)
+            return
+        match = re.search(r';searchTerm=([^;?]*)', request.path)
+        term = unquote(match.group(1)) if match else ""
+        if not is_py3:
+            term = term.decode('utf-8')
+        body = json.dumps({ 'data': { 'items': self.search(term) } }).encode('utf-8')
+        self._reply(request, 200, "application/json", body)
+
+    def _reply(self, request, status, content_type, body, headers={}):
+        request.send_response(status)
+        request.send_header("Content-Type", content_type)
+        request.send_header("Content-Length", str(len(body)))
+        for name, value in headers.items():
+            request.send_header(name, value)
+        request.end_headers()
+        request.wfile.write(body)
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve a fake searchassist API, "
+                                     "use it with YahooTickerDownloader.py --insecure --host HOST:PORT")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--universe", help="A .csv or .ndjson export to serve, or the number of made up symbols", default="10000")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--max-results", type=int, default=10)
+    parser.add_argument("--latency", help="Seconds every request takes", type=float, default=0)
+    parser.add_argument("--error-rate", help="The share of requests that fail with a 429 or 503", type=float, default=0)
+    args = parser.parse_args()
+
+    if args.universe.isdigit():
+        universe = synthetic_universe(int(args.universe), args.seed)
+    else:
+        universe = load_universe(args.universe)
+    server = FakeServer(universe, args.host, args.port, args.max_results, args.latency,
+                        args.error_rate, seed=args.seed)
+    print("Serving " + str(len(universe)) + " symbols on " + server.address)
+    server.server.serve_forever()
+
+if __name__ == "__main__":
+    main()
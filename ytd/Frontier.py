@@ -0,0 +1,257 @@
+import heapq
+import io
+import os
+from collections import deque as Deque
+from itertools import islice
+
+from .Query import Query
+
+class StagedFrontier:
+    """The queries still to fetch, FIFO until 2000 are queued and LIFO from then on
+
+    Going breadth first at the start finds the result counts that need
+    narrowing early, going depth first after that keeps the frontier small.
+    """
+
+    # It does not use the novel counts and guesses add() is given
+    ranked = False
+
+    def __init__(self, queries=(), stage1=True):
+        self.queries = Deque(queries)
+        self.stage1 = stage1
+
+    def add(self, parent, children, novel, guessed):
+        if self.stage1:
+            self.queries.extend(children)
+        else:
+            # So they are taken in order
+            self.queries.extend(children[::-1])
+
+    def take(self):
+        if self.stage1:
+            # switch to LIFO when there are 2000 staged queries
+            if len(self.queries) >= 2000:
+                self.stage1 = False
+            return self.queries.popleft()
+        return self.queries.pop()
+
+    def putBack(self, queries):
+        # Queries that were taken, so they are taken again first
+        if self.stage1:
+            self.queries.extendleft(queries)
+        else:
+            self.queries.extend(queries)
+
+    def remove(self, query):
+        self.queries.remove(query)
+
+    def spill(self):
+        # Only SpillFrontier keeps queries out of memory
+        pass
+
+    def rewrite(self):
+        # Only SpillFrontier has a file to rewrite before a snapshot
+        pass
+
+    def __len__(self):
+        return len(self.queries)
+
+    def __iter__(self):
+        return iter(self.queries)
+
+class SpillFrontier(StagedFrontier):
+    """A StagedFrontier that keeps at most window queries in memory
+
+    Once it is LIFO, the queries at the bottom of the stack beyond the
+    window are written to path and dropped from their parent's children.
+    A segment holds one line per parent: its query string and the
+    characters of its spilled children. When the window is empty the last
+    segment is read back and its queries are created again.
+
+    Segments are only appended to the file, so a saved state that refers
+    to them stays valid after they were read back. rewrite() copies the
+    segments that are left to a fresh file before a snapshot is written,
+    path and path.1 take turns so the file of the snapshot on disk is not
+    touched. That keeps the files from growing without bound.
+    """
+
+    # Saved before the files took turns, it was always path
+    file = None
+
+    def __init__(self, path, window=100000, queries=(), stage1=True):
+        StagedFrontier.__init__(self, queries, stage1)
+        self.path = path
+        self.file = path
+        self.window = window
+        # (offset, length, number of queries), the last one is read back first
+        self.segments = []
+        self.spilled = 0
+        self.root = None
+
+    def spill(self):
+        # Called between batches, so a store has seen every query in memory
+        if self.stage1 or len(self.queries) <= self.window:
+            return
+        if self.root is None:
+            self.root = self.queries[0]
+            while self.root.parent is not None:
+                self.root = self.root.parent
+        # Half the window stays, so this does not happen again right away
+        queries = [ self.queries.popleft() for i in range(len(self.queries) - self.window // 2) ]
+        self.write((query.parent, query.char) for query in queries)
+        spilled = set(map(id, queries))
+        for parent in set(query.parent for query in queries):
+            parent.children = [ child for child in parent.children if id(child) not in spilled ]
+
+    def write(self, queries):
+        """Adds (parent, char) pairs below the queries in memory, the first is taken last
+
+        The pairs can be a generator, they are written in segments of half
+        the window, so reading one back never needs more than that.
+        """
+        queries = iter(queries)
+        size = max(1, self.window // 2)
+        with io.open(self.file or self.path, "ab") as f:
+            while True:
+                segment = list(islice(queries, size))
+                if not segment:
+                    break
+                lines = []
+                for (parent, char) in segment:
+                    if not lines or lines[-1][0] is not parent:
+                        lines.append((parent, []))
+                    lines[-1][1].append(char)
+                data = u"".join(parent.query_string + u"\t" + u"".join(chars) + u"\n"
+                                for (parent, chars) in lines).encode("utf-8")
+                f.seek(0, os.SEEK_END)
+                self.segments.append((f.tell(), len(data), len(segment)))
+                f.write(data)
+                self.spilled += len(segment)
+
+    def _read(self, segment):
+        # The (parent, chars) lines of a segment
+        (offset, length, count) = segment
+        with io.open(self.file or self.path, "rb") as f:
+            f.seek(offset)
+            data = f.read(length).decode("utf-8")
+        for line in data.split(u"\n")[:-1]:
+            (parent, chars) = line.split(u"\t")
+            yield (self._find(parent), chars)
+
+    def clear(self):
+        """Removes the files of an earlier frontier at path, for a new one"""
+        for name in (self.path, self.path + ".1"):
+            if os.path.exists(name):
+                os.remove(name)
+
+    def rewrite(self):
+        """Moves the segments that were not read back to the other file, before a snapshot"""
+        current = self.file or self.path
+        target = self.path + ".1" if current == self.path else self.path
+        segments = []
+        with io.open(target, "wb") as out:
+            if self.segments:
+                with io.open(current, "rb") as f:
+                    for (offset, length, count) in self.segments:
+                        f.seek(offset)
+                        segments.append((out.tell(), length, count))
+                        out.write(f.read(length))
+            out.flush()
+            os.fsync(out.fileno())
+        self.segments = segments
+        self.file = target
+
+    def _find(self, query_string):
+        # Spilled queries keep their parent's query string, the parent is
+        # still in the tree because it waits for them
+        query = self.root
+        rest = query_string[len(self.root.query_string):]
+        while rest:
+            # The first queries can add more than one character
+            query = next(child for child in query.children if child.char and rest.startswith(child.char))
+            rest = rest[len(query.char):]
+        return query
+
+    def take(self):
+        if not self.queries and self.segments:
+            segment = self.segments.pop()
+            self.spilled -= segment[2]
+            for (parent, chars) in self._read(segment):
+                children = [ Query(parent.query_string + char, parent) for char in chars ]
+                parent.children = list(parent.children) + children
+                self.queries.extend(children)
+        return StagedFrontier.take(self)
+
+    def __len__(self):
+        return len(self.queries) + self.spilled
+
+    def __iter__(self):
+        # Spilled queries are created just for this, they are not in the tree
+        for segment in self.segments:
+            for (parent, chars) in self._read(segment):
+                for char in chars:
+                    yield Query(parent.query_string + char, parent)
+        for query in self.queries:
+            yield query
+
+def estimate(parent, novel):
+    """The expected share of new symbols in the results of parent's children
+
+    That is the share of parent's own results that were new when it was
+    fetched, smoothed so a parent without results is at 1/2.
+    """
+    return (novel + 1.0) / (len(parent.results) + 2.0)
+
+class YieldFrontier:
+    """The queries still to fetch, the ones most likely to find new symbols first
+
+    Children of a query that was only narrowed because the downloader does
+    not know yet whether its result count means there are more come first.
+    Finishing those subtrees is how it learns to stop narrowing, and
+    narrowing too much costs more requests than anything else. The others
+    are ranked by estimate() of their parent. Then the longest query goes
+    first, so subtrees are finished, then the one added first. The order
+    only depends on the results in the order they were processed, so a
+    journal replays the same way.
+    """
+
+    ranked = True
+
+    def __init__(self):
+        # (-estimate, -length, sequence number, query)
+        self.heap = []
+        self.added = 0
+        # Never switches to anything, for save_state and the sqlite store
+        self.stage1 = False
+
+    def add(self, parent, children, novel, guessed):
+        # estimate() is at most 1
+        rank = -2.0 if guessed else -estimate(parent, novel)
+        for child in children:
+            heapq.heappush(self.heap, (rank, -len(child.query_string), self.added, child))
+            self.added += 1
+
+    def take(self):
+        return heapq.heappop(self.heap)[3]
+
+    def putBack(self, queries):
+        # How they were ranked is not known anymore
+        for query in queries:
+            self.add(query.parent, [ query ], 0, False)
+
+    def remove(self, query):
+        self.heap = [ entry for entry in self.heap if entry[3] is not query ]
+        heapq.heapify(self.heap)
+
+    def spill(self):
+        pass
+
+    def rewrite(self):
+        pass
+
+    def __len__(self):
+        return len(self.heap)
+
+    def __iter__(self):
+        # In the order they would be taken, without changing the heap
+        return iter([ entry[3] for entry in sorted(self.heap, key=lambda entry: entry[:3]) ])
@@ -0,0 +1,93 @@
+from .PrefixIndex import PrefixIndex
+
+class FrontierPruner:
+    """Skips child queries that are unlikely to find any ticker that is not known yet
+
+    Every child query is put in a class by its length and by how many
+    collected tickers and name words start with it. The share of fetched
+    children of a class that returned a new ticker is that class's yield.
+    Once a class has been sampled enough and its yield is below max_yield,
+    only one in sample_every of its children is still fetched, to keep
+    measuring, and the others are deferred. Nothing here may depend on
+    timing, journal replay has to make the same decisions.
+    """
+
+    def __init__(self, min_samples=100, max_yield=0.02, sample_every=10):
+        self.min_samples = min_samples
+        self.max_yield = max_yield
+        self.sample_every = sample_every
+        self.index = PrefixIndex()
+        # class -> [ children seen, fetched, fetched that found a new ticker ]
+        self.stats = {}
+        # The class of every child query that is scheduled but not fetched yet
+        self.classes = {}
+        self.deferred = []
+
+    def __getstate__(self):
+        # The index is rebuilt from the symbols, see rebuild()
+        state = self.__dict__.copy()
+        del state['index']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.index = PrefixIndex()
+
+    def rebuild(self, symbols):
+        for symbol in symbols:
+            self.index.addSymbol(symbol)
+
+    def _class(self, query_string):
+        return (len(query_string), min(self.index.count(query_string.upper()), 10))
+
+    def _pruning(self, stats):
+        (seen, fetched, productive) = stats
+        return fetched >= self.min_samples and productive < self.max_yield * fetched
+
+    def select(self, query, search_characters):
+        """The characters of the children of query that should be fetched"""
+        query_string = query.query_string
+        selected = []
+        for c in search_characters:
+            child_string = query_string + c
+            cls = self._class(child_string)
+            stats = self.stats.setdefault(cls, [ 0, 0, 0 ])
+            stats[0] += 1
+            if self._pruning(stats) and stats[0] % self.sample_every != 0:
+                self.deferred.append(child_string)
+            else:
+                self.classes[child_string] = cls
+                selected.append(c)
+        return selected
+
+    def record(self, query, symbols):
+        """Account for the results of a fetched query, before they are applied"""
+        cls = self.classes.pop(query.query_string, None)
+        if cls is not None:
+            stats = self.stats.setdefault(cls, [ 0, 0, 0 ])
+            stats[1] += 1
+            if any(symbol.ticker.upper() not in self.index for symbol in symbols):
+                stats[2] += 1
+        for symbol in symbols:
+            self.index.addSymbol(symbol)
+
+    def verify(self, downloader, budget, insecure=False):
+        """Fetch up to budget deferred queries, spread over all of them
+
+        Returns the number of queries checked and the symbols they found
+        that the download did not.
+        """
+        step = max(1, len(self.deferred) // max(1, budget))
+        sample = self.deferred[::step][:budget]
+        missed = {}
+        for (symbols, count) in downloader.fetchMany(sample, insecure):
+            for symbol in symbols:
+                if symbol.ticker not in downloader.symbols:
+                    missed[symbol.ticker] = symbol
+        return (len(sample), missed)
+
+    def describe(self):
+        seen = sum(stats[0] for stats in self.stats.values())
+        return ("Pruning: deferred " + str(len(self.deferred)) + " of " + str(seen) + " child queries, "
+                + str(sum(1 for stats in self.stats.values() if self._pruning(stats))) + " of "
+                + str(len(self.stats)) + " classes pruned")
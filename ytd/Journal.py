@@ -0,0 +1,108 @@
+import os
+import pickle
+
+from .compat import replace
+
+class Journal:
+    """Checkpoints a downloader as a snapshot plus an append-only journal
+
+    <name>.pickle holds a full save_state() snapshot followed by its
+    generation number. <name>.journal starts with the same generation number
+    and then holds one journal_record() per completed batch, so a checkpoint
+    only costs as much as the batch it records. The journal is folded into
+    a new snapshot every compact_every batches, or sooner if it grows larger
+    than the snapshot itself.
+    """
+
+    def __init__(self, name, compact_every=100):
+        self.snapshot_path = name + ".pickle"
+        self.journal_path = name + ".journal"
+        self.compact_every = compact_every
+        self.generation = 0
+        self.records = 0
+
+    def load(self, downloader):
+        """Restore downloader from the snapshot and replay the journal on top of it
+
+        Raises IOError if there is no snapshot.
+        """
+        with open(self.snapshot_path, "rb") as f:
+            downloader_data = pickle.load(f)
+            try:
+                self.generation = pickle.load(f)
+            except EOFError:
+                # Written before there were journals
+                self.generation = 0
+        downloader.restore_state(downloader_data)
+        self.records = self._replay(downloader)
+        return downloader
+
+    def _replay(self, downloader):
+        records = 0
+        try:
+            f = open(self.journal_path, "rb")
+        except IOError:
+            return records
+        with f:
+            try:
+                if pickle.load(f) != self.generation:
+                    # Left behind by a compaction that was interrupted,
+                    # the snapshot already contains it
+                    return records
+                end = f.tell()
+                while True:
+                    downloader.replay_batch(pickle.load(f))
+                    records += 1
+                    end = f.tell()
+            except (EOFError, pickle.UnpicklingError):
+                # Either the end of the journal or a record that was being
+                # written when we were interrupted. The batch is simply redone.
+                pass
+        if records > 0:
+            # Drop any partial record so new records are appended after the good ones
+            with open(self.journal_path, "r+b") as f:
+                f.truncate(end)
+        return records
+
+    def append(self, downloader):
+        """Record the batch the downloader just completed"""
+        if not os.path.exists(self.snapshot_path):
+            # There is nothing to replay a journal on yet
+            self.compact(downloader)
+            return
+        if self.records == 0:
+            self._start_journal()
+        with open(self.journal_path, "ab") as f:
+            pickle.dump(downloader.journal_record(), f, protocol=pickle.HIGHEST_PROTOCOL)
+            f.flush()
+            os.fsync(f.fileno())
+        self.records += 1
+
+        if self.records >= self.compact_every or self._journal_outgrew_snapshot():
+            self.compact(downloader)
+
+    def compact(self, downloader):
+        """Write a full snapshot and start an empty journal"""
+        self.generation += 1
+        # A frontier that spills leaves what was read back behind
+        downloader.queries.rewrite()
+        tmp_path = self.snapshot_path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            pickle.dump(downloader.save_state(), file=f, protocol=pickle.HIGHEST_PROTOCOL)
+            pickle.dump(self.generation, file=f, protocol=pickle.HIGHEST_PROTOCOL)
+            f.flush()
+            os.fsync(f.fileno())
+        # The old snapshot stays intact until the new one is complete
+        replace(tmp_path, self.snapshot_path)
+        self._start_journal()
+
+    def _start_journal(self):
+        with open(self.journal_path, "wb") as f:
+            pickle.dump(self.generation, f, protocol=pickle.HIGHEST_PROTOCOL)
+        self.records = 0
+
+    def _journal_outgrew_snapshot(self):
+        try:
+            return os.path.getsize(self.journal_path) > os.path.getsize(self.snapshot_path)
+        except OSError:
+            return True
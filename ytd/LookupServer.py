@@ -0,0 +1,129 @@
+import json
+import os
+from threading import Event, Thread
+
+from .compat import is_py3, parse_qs
+
+# No lookup returns more symbols than this
+max_limit = 1000
+
+def parse_address(address):
+    """(host, port) from HOST:PORT, anything else is the path of a Unix socket"""
+    (host, sep, port) = address.rpartition(':')
+    if sep and port.isdigit():
+        return (host, int(port))
+    return address
+
+class LookupServer:
+    """Answers symbol lookups over HTTP from the .index files of some types
+
+    indexes is type -> ytd.SymbolIndex. Every lookup takes the same
+    parameters and returns JSON:
+
+        /<type>/symbol?ticker=AAPL            the symbol with this ticker
+        /<type>/tickers?prefix=AA             the symbols whose tickers start with it
+        /<type>/names?q=apple                 the symbols with names that have words starting with these
+        /<type>/exchange?exchange=NMS         the symbols of this exchange
+
+    exchange narrows tickers and names down too, and limit is how many
+    symbols to return, 100 by default. / lists the types and their counts.
+    The indexes are reloaded within interval seconds after an export
+    replaced them, without stopping to answer.
+    """
+
+    def __init__(self, indexes, interval=1):
+        self.indexes = indexes
+        self.interval = interval
+        self.server = None
+        self.stopped = Event()
+
+    def serve(self, address):
+        """Serves on a daemon thread, address is (host, port) or the path of a Unix socket"""
+        # Only imported when lookups are served
+        if is_py3:
+            from http.server import HTTPServer, BaseHTTPRequestHandler
+            from socketserver import ThreadingMixIn, UnixStreamServer
+        else:
+            from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+            from SocketServer import ThreadingMixIn, UnixStreamServer
+
+        lookups = self
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                lookups._handle(self)
+
+        if isinstance(address, tuple):
+            class Server(ThreadingMixIn, HTTPServer):
+                daemon_threads = True
+        else:
+            class Server(ThreadingMixIn, UnixStreamServer):
+                daemon_threads = True
+            if os.path.exists(address):
+                # Left behind by a server that did not close
+                os.remove(address)
+
+        self.server = Server(address, Handler)
+        t = Thread(target=self.server.serve_forever)
+        t.daemon = True
+        t.start()
+        t = Thread(target=self._reload)
+        t.daemon = True
+        t.start()
+        return self.server.server_address
+
+    def _reload(self):
+        while not self.stopped.wait(self.interval):
+            for (type, index) in self.indexes.items():
+                if index.reload():
+                    print("Reloaded " + index.path + ", " + str(len(index)) + " " + type + " symbols")
+
+    def lookup(self, path, query):
+        """(status, answer) of a request for path with the query parameters query"""
+        parts = path.strip("/").split("/")
+        if parts == [ "" ]:
+            return (200, { "types": dict((type, len(index)) for (type, index) in self.indexes.items()) })
+        if len(parts) != 2 or parts[0] not in self.indexes:
+            return (404, { "error": "Not found" })
+        index = self.indexes[parts[0]]
+        parameter = lambda name: query.get(name, [ None ])[0]
+        try:
+            limit = min(int(parameter("limit") or 100), max_limit)
+        except ValueError:
+            return (400, { "error": "limit is not a number" })
+
+        if parts[1] == "symbol" and parameter("ticker"):
+            symbol = index.get(parameter("ticker"))
+            if symbol is None:
+                return (404, { "error": "No symbol " + parameter("ticker") })
+            return (200, { "symbol": symbol })
+        elif parts[1] == "tickers" and parameter("prefix") is not None:
+            symbols = index.tickers(parameter("prefix"), parameter("exchange"), limit)
+        elif parts[1] == "names" and parameter("q"):
+            symbols = index.names(parameter("q"), parameter("exchange"), limit)
+        elif parts[1] == "exchange" and parameter("exchange"):
+            symbols = index.exchange(parameter("exchange"), limit)
+        else:
+            return (400, { "error": "Unknown lookup or missing parameter, see ytd.LookupServer" })
+        return (200, { "symbols": symbols })
+
+    def _handle(self, request):
+        (path, _, query) = request.path.partition("?")
+        (status, answer) = self.lookup(path, parse_qs(query, keep_blank_values=True))
+        body = json.dumps(answer, ensure_ascii=False).encode("utf-8")
+        request.send_response(status)
+        request.send_header("Content-Type", "application/json; charset=utf-8")
+        request.send_header("Content-Length", str(len(body)))
+        request.end_headers()
+        request.wfile.write(body)
+
+    def close(self):
+        self.stopped.set()
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            if not isinstance(self.server.server_address, tuple):
+                os.remove(self.server.server_address)
+            self.server = None
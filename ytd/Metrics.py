@@ -0,0 +1,218 @@
+import json
+import re
+from bisect import bisect_left
+from threading import Thread, Lock, Event
+from time import time
+
+from .compat import is_py3, replace
+from . import Profiler
+
+prefix = "ytd_"
+
+# histogram -> (upper bounds of its buckets, help)
+histograms = {
+    "request_seconds": ((0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30),
+                        "Time from sending a search to having its response"),
+    "decode_seconds": ((0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.05, 0.1),
+                       "Time decodeSymbolsContainer took for a response"),
+    "apply_seconds": ((0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.01, 0.1),
+                      "Time the single writer took to apply a decoded response"),
+    "checkpoint_seconds": ((0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 300),
+                           "Time saving the download state took"),
+    "symbols_per_request": ((0, 1, 2, 3, 5, 8, 9, 10),
+                            "Symbols in a search response"),
+}
+
+counters = {
+    "requests_total": "Searches sent, by HTTP status or error",
+    "retries_total": "Searches sent again, by the exception that failed them",
+    "cached_total": "Searches answered by the response cache",
+    "route_errors_total": "Searches that got no response at all, by route",
+}
+
+class Histogram:
+    def __init__(self, bounds):
+        self.bounds = bounds
+        # The last bucket is +Inf
+        self.buckets = [ 0 ] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.buckets[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+def _labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join('%s="%s"' % (name, re.sub(r'(["\\])', r'\\\1', str(value)))
+                          for (name, value) in labels) + "}"
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Metrics:
+    """Counters, histograms and gauges of a crawl
+
+    Counters and histograms are updated by the downloader and its engines.
+    A gauge is a function that is called when the metrics are read, like
+    the size of a queue, and returns None while it has no value yet.
+    render() gives the Prometheus text format, see serve() and
+    writeEvery() to make them available while crawling.
+    """
+
+    def __init__(self):
+        self.lock = Lock()
+        # name -> { sorted label tuples -> value }
+        self.counters = {}
+        self.histograms = dict((name, Histogram(bounds)) for (name, (bounds, help)) in histograms.items())
+        # name -> (function, help)
+        self.gauges = {}
+        self.started = time()
+        self.server = None
+        self.stopped = Event()
+
+    def count(self, name, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            values = self.counters.setdefault(name, {})
+            values[key] = values.get(key, 0) + amount
+
+    def observe(self, name, value):
+        with self.lock:
+            self.histograms[name].observe(value)
+
+    def gauge(self, name, function, help=""):
+        self.gauges[name] = (function, help)
+
+    def _gauge_values(self):
+        values = {}
+        for name, (function, help) in self.gauges.items():
+            try:
+                values[name] = function()
+            except Exception:
+                # Gauges read state other threads are changing
+                pass
+        return values
+
+    def render(self):
+        lines = []
+        with self.lock:
+            for name in sorted(self.counters):
+                lines.append("# HELP " + prefix + name + " " + counters.get(name, ""))
+                lines.append("# TYPE " + prefix + name + " counter")
+                for key, value in sorted(self.counters[name].items()):
+                    lines.append(prefix + name + _labels(key) + " " + _number(value))
+            for name in sorted(self.histograms):
+                histogram = self.histograms[name]
+                lines.append("# HELP " + prefix + name + " " + histograms[name][1])
+                lines.append("# TYPE " + prefix + name + " histogram")
+                cumulative = 0
+                for bound, count in zip(list(histogram.bounds) + ["+Inf"], histogram.buckets):
+                    cumulative += count
+                    lines.append(prefix + name + "_bucket" + _labels([("le", bound)]) + " " + str(cumulative))
+                lines.append(prefix + name + "_sum " + _number(histogram.sum))
+                lines.append(prefix + name + "_count " + str(histogram.count))
+        gauges = self._gauge_values()
+        for name in sorted(gauges):
+            if gauges[name] is None:
+                # Not measured yet, like the utilization before the first batch
+                continue
+            lines.append("# HELP " + prefix + name + " " + self.gauges[name][1])
+            lines.append("# TYPE " + prefix + name + " gauge")
+            lines.append(prefix + name + " " + _number(gauges[name]))
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self):
+        """The metrics as a dict that can be written as JSON"""
+        result = { "time": time(), "uptime_seconds": time() - self.started }
+        with self.lock:
+            for name, values in self.counters.items():
+                result[name] = dict((",".join("%s=%s" % label for label in key) or "total", value)
+                                    for key, value in values.items())
+            for name, histogram in self.histograms.items():
+                result[name] = {
+                    "buckets": dict(zip([ str(bound) for bound in histogram.bounds ] + ["+Inf"], histogram.buckets)),
+                    "sum": histogram.sum,
+                    "count": histogram.count,
+                    "mean": histogram.sum / histogram.count if histogram.count else None,
+                }
+        result.update(self._gauge_values())
+        return result
+
+    def writeJson(self, path):
+        # Written next to it first, a reader never sees half a file
+        with open(path + ".tmp", "w") as f:
+            json.dump(self.snapshot(), f, indent=4, sort_keys=True)
+        replace(path + ".tmp", path)
+
+    def writeEvery(self, path, interval=10):
+        """Writes snapshot() to path every interval seconds until close()"""
+        def work():
+            while not self.stopped.wait(interval):
+                self.writeJson(path)
+        t = Thread(target=work)
+        t.daemon = True
+        t.start()
+
+    def serve(self, host, port):
+        """Serves the metrics over HTTP on a daemon thread
+
+        /metrics is the Prometheus text format and /metrics.json the
+        snapshot. /stacks shows what every thread is doing right now, and
+        /profile?seconds=N samples the stacks for N seconds and returns them
+        in the collapsed format of flame graph tools.
+        """
+        # Only imported when metrics are served
+        if is_py3:
+            from http.server import HTTPServer, BaseHTTPRequestHandler
+            from socketserver import ThreadingMixIn
+        else:
+            from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+            from SocketServer import ThreadingMixIn
+
+        metrics = self
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                metrics._handle(self)
+
+        class Server(ThreadingMixIn, HTTPServer):
+            daemon_threads = True
+
+        self.server = Server((host, port), Handler)
+        t = Thread(target=self.server.serve_forever)
+        t.daemon = True
+        t.start()
+        return self.server.server_address
+
+    def _handle(self, request):
+        path = request.path.split("?")[0]
+        if path == "/metrics":
+            (status, content_type, body) = (200, "text/plain; version=0.0.4", self.render())
+        elif path == "/metrics.json":
+            (status, content_type, body) = (200, "application/json", json.dumps(self.snapshot(), sort_keys=True))
+        elif path == "/stacks":
+            (status, content_type, body) = (200, "text/plain", Profiler.dump_stacks())
+        elif path == "/profile":
+            match = re.search(r'[?&]seconds=([0-9.]+)', request.path)
+            seconds = min(float(match.group(1)), 300) if match else 5
+            (status, content_type, body) = (200, "text/plain", Profiler.sample(seconds))
+        else:
+            (status, content_type, body) = (404, "text/plain", "Not found\n")
+        body = body.encode("utf-8")
+        request.send_response(status)
+        request.send_header("Content-Type", content_type)
+        request.send_header("Content-Length", str(len(body)))
+        request.end_headers()
+        request.wfile.write(body)
+
+    def close(self):
+        self.stopped.set()
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
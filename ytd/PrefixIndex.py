@@ -0,0 +1,52 @@
+import re
+from bisect import bisect_left, insort
+
+_separators = re.compile(r'[^\w.=]+', re.UNICODE)
+
+def name_tokens(name):
+    """The words of a symbol's name, as the search matches them"""
+    if not name:
+        return []
+    return [ token for token in _separators.split(name.upper()) if token ]
+
+class PrefixIndex:
+    """A sorted set of strings that counts the ones starting with a prefix
+
+    New strings go into a small sorted list that is merged into the large
+    one once it grows past the square root of its size, so adding stays
+    cheap with millions of strings.
+    """
+
+    def __init__(self):
+        self.members = set()
+        self.merged = []
+        self.recent = []
+
+    def add(self, key):
+        if key in self.members:
+            return
+        self.members.add(key)
+        insort(self.recent, key)
+        if len(self.recent) > max(1000, len(self.merged) ** 0.5):
+            # Timsort merges two sorted runs in linear time
+            self.merged.extend(self.recent)
+            self.merged.sort()
+            self.recent = []
+
+    def addSymbol(self, symbol):
+        self.add(symbol.ticker.upper())
+        for token in name_tokens(symbol.name):
+            self.add(token)
+
+    def count(self, prefix):
+        """The number of strings starting with prefix"""
+        return self._count(self.merged, prefix) + self._count(self.recent, prefix)
+
+    def _count(self, keys, prefix):
+        return bisect_left(keys, prefix + u'\uffff') - bisect_left(keys, prefix)
+
+    def __contains__(self, key):
+        return key in self.members
+
+    def __len__(self):
+        return len(self.members)
@@ -0,0 +1,43 @@
+import sys
+import threading
+import traceback
+from collections import Counter
+from time import sleep, time
+
+def _thread_names():
+    return dict((t.ident, t.name) for t in threading.enumerate())
+
+def dump_stacks():
+    """The current stack of every thread, as text"""
+    names = _thread_names()
+    lines = []
+    for ident, frame in sys._current_frames().items():
+        lines.append("Thread " + names.get(ident, str(ident)) + ":\n")
+        lines.extend(traceback.format_stack(frame))
+        lines.append("\n")
+    return "".join(lines)
+
+def sample(seconds=5.0, interval=0.005):
+    """Samples the stacks of all other threads for a while
+
+    Returns the samples in the collapsed format flame graph tools read:
+    one "outermost;...;innermost count" line per distinct stack, the most
+    frequent first. Threads that are waiting on a lock or a queue show up
+    too, which is what makes queueing visible.
+    """
+    me = threading.current_thread().ident
+    stacks = Counter()
+    end = time() + seconds
+    while time() < end:
+        for ident, frame in sys._current_frames().items():
+            if ident == me:
+                continue
+            functions = []
+            while frame is not None:
+                code = frame.f_code
+                functions.append(code.co_name + " (" + code.co_filename.rsplit("/", 1)[-1]
+                                 + ":" + str(frame.f_lineno) + ")")
+                frame = frame.f_back
+            stacks[";".join(reversed(functions))] += 1
+        sleep(interval)
+    return "".join(stack + " " + str(count) + "\n" for stack, count in stacks.most_common())
@@ -1,33 +1,91 @@
 from collections import OrderedDict
 
-class Query:
-    """Query String, results and summary of children's results"""
+class Query(object):
+    """Query String, results and summary of children's results
+
+    Nodes only store the character they add to their parent's query string.
+    Instead of a list of all tickers found below it, a done node keeps just
+    children_count, the number of distinct tickers its descendants returned.
+    The tickers themselves are only held by nodes that are still waiting on
+    children (subtree_results) and are handed up to the parent once done.
+    """
+
+    __slots__ = ('char', 'parent', 'children', 'num_children', 'num_complete',
+                 'results', 'subtree_results', 'children_count', 'is_done')
+
     def __init__(self, query_string, parent):
-        self.query_string = query_string
+        # The root keeps its whole query string
+        self.char = query_string if parent is None else query_string[len(parent.query_string):]
         self.parent = parent # <--- may be "None"
-        self.children = []
+        self.children = ()
         self.num_children = 0
         self.num_complete = 0
-        self.results = []
-        self.children_results = []
+        self.results = ()
+        self.subtree_results = None
+        self.children_count = 0
         self.is_done = False
 
+    @property
+    def query_string(self):
+        if self.parent is None:
+            return self.char
+        return self.parent.query_string + self.char
+
     def addChildren(self, search_characters):
         # ensure search_characters are all unique
         #search_list = set(search_characters) # will not preserve order
         search_list = OrderedDict.fromkeys(search_characters).keys()
         self.num_children += len(search_list)
+        query_string = self.query_string
+        children = list(self.children)
         for e in search_list:
-            element = self.query_string + e
-            self.children.append(Query(element, self))
-                
+            children.append(Query(query_string + e, self))
+        self.children = children
+
     def done(self):
         self.is_done = True
+        subtree_results = self.subtree_results
+        self.subtree_results = None
+        self.children_count = len(subtree_results) if subtree_results else 0
         if self.parent is not None:
-            self.parent.child_done(self)
+            self.parent.child_done(self, subtree_results)
 
-    def child_done(self, child):
+    def child_done(self, child, subtree_results=None):
         self.num_complete += 1
-        self.children_results = list(set(self.children_results + child.results + child.children_results))
+        # subtree_results is not used by child anymore, so it can be reused
+        if subtree_results is None:
+            subtree_results = set(child.results)
+        else:
+            subtree_results.update(child.results)
+        merged = self.subtree_results
+        # Merge the smaller set into the larger one
+        if merged is None or len(subtree_results) > len(merged):
+            (merged, subtree_results) = (subtree_results, merged)
+        if subtree_results:
+            merged.update(subtree_results)
+        self.subtree_results = merged
         if self.num_complete == self.num_children:
             self.done()
+
+    def __getstate__(self):
+        return tuple(getattr(self, slot) for slot in self.__slots__)
+
+    def __setstate__(self, state):
+        if isinstance(state, dict):
+            # Pickled before nodes had __slots__
+            if state['parent'] is None:
+                self.char = state['query_string']
+            else:
+                self.char = state['query_string'][-1:]
+            self.parent = state['parent']
+            self.children = state['children']
+            self.num_children = state['num_children']
+            self.num_complete = state['num_complete']
+            self.results = tuple(state['results'])
+            self.is_done = state['is_done']
+            children_results = set(state['children_results'])
+            self.children_count = len(children_results)
+            self.subtree_results = None if self.is_done or not children_results else children_results
+        else:
+            for slot, value in zip(self.__slots__, state):
+                setattr(self, slot, value)
@@ -0,0 +1,145 @@
+import pickle
+
+from .compat import replace
+from .SimpleSymbolDownloader import general_search_characters
+
+# Names of the policies in saved
+ALPHABET = "alphabet"
+RESULT_COUNTS = "result counts"
+
+class QueryStats:
+    """What earlier crawls learned about the queries, used by the next ones
+
+    <path> holds the statistics of every crawl merged into it: for every
+    length and last character of a query, how often it was fetched, came
+    back empty and found a symbol that was new to its crawl, and for every
+    result count how many crawls found that narrowing it finds more and
+    how often it found the same results.
+
+    Two policies come from it when it is attached to a crawl. The result
+    counts the crawl does not know what to do with yet are learned from all
+    crawls the way querySurvey() learns them within one. And at every
+    length, the characters whose children next to never found a new symbol are left
+    out, except for one in sample_every children so they keep being
+    measured. Both stay the same for the whole crawl, journal replay has to
+    make the same decisions. merge() adds the crawl to <path> once it is
+    done.
+    """
+
+    def __init__(self, path, min_samples=100, max_yield=0.001, sample_every=10):
+        self.path = path
+        self.sample_every = sample_every
+        (self.crawls, self.children, self.counts, self.saved_total) = self._read()
+        # (length, character) that are left out
+        self.skip = set(key for (key, (fetched, empty, productive)) in self.children.items()
+                        if fetched >= min_samples and productive <= max_yield * fetched)
+        # Result counts that are not narrowed because of earlier crawls
+        self.seeded = set()
+        # What this crawl saw, the same as children
+        self.seen = {}
+        # (length, character) -> children left out or sampled, for the sampling
+        self.offered = {}
+        # Child queries this crawl did not fetch, by policy
+        self.saved = { ALPHABET: 0, RESULT_COUNTS: 0 }
+
+    def __getstate__(self):
+        # What the earlier crawls learned is read from <path> again, merge() reads it anyway
+        state = self.__dict__.copy()
+        for key in ('children', 'counts', 'saved_total'):
+            del state[key]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        (_, self.children, self.counts, self.saved_total) = self._read()
+
+    def _read(self):
+        try:
+            with open(self.path, "rb") as f:
+                return pickle.load(f)
+        except IOError:
+            return (0, {}, {}, {})
+
+    def actions(self, result_count_action):
+        """result_count_action with what all merged crawls learned, by the rule of querySurvey()"""
+        actions = [ 0 if a is None else a for a in result_count_action ]
+        for i in range(len(actions)):
+            if not isinstance(actions[i], bool):
+                (more, same) = self.counts.get(i, (0, 0))
+                actions[i] = True if more else same
+        learned = list(result_count_action)
+        for i in range(len(actions)):
+            if not isinstance(actions[i], bool):
+                if actions[i] >= 20:
+                    for j in range(i + 1):
+                        learned[j] = False
+            elif actions[i]:
+                for j in range(i, len(learned)):
+                    learned[j] = True
+        return learned
+
+    def seed(self, downloader):
+        """Fills in the result counts downloader does not know what to do with yet"""
+        for (i, action) in enumerate(self.actions(downloader.result_count_action)):
+            if downloader.result_count_action[i] is None and action is not None:
+                downloader.result_count_action[i] = action
+                if not action:
+                    self.seeded.add(i)
+
+    def select(self, query, search_characters):
+        """The characters of the children of query that should be fetched"""
+        selected = []
+        for c in search_characters:
+            key = (len(query.query_string + c), c)
+            if key in self.skip:
+                self.offered[key] = self.offered.get(key, 0) + 1
+                if self.offered[key] % self.sample_every != 0:
+                    self.saved[ALPHABET] += 1
+                    continue
+            selected.append(c)
+        return selected
+
+    def record(self, query, count, novel, narrowed):
+        """Account for the result of a fetched query, novel of its count symbols were new"""
+        stats = self.seen.setdefault((len(query.query_string), query.char), [ 0, 0, 0 ])
+        stats[0] += 1
+        if count == 0:
+            stats[1] += 1
+        if novel > 0:
+            stats[2] += 1
+        if not narrowed and count in self.seeded:
+            self.saved[RESULT_COUNTS] += len(general_search_characters)
+
+    def merge(self, downloader):
+        """Adds this crawl of downloader to <path>, it should be done"""
+        # Read again, another crawl can have been merged meanwhile
+        (crawls, children, counts, saved_total) = self._read()
+        for (key, values) in self.seen.items():
+            total = children.setdefault(key, [ 0, 0, 0 ])
+            for i in range(len(values)):
+                total[i] += values[i]
+        for count in range(len(downloader.survey_same)):
+            (more, same) = counts.get(count, (0, 0))
+            counts[count] = (more + int(downloader.survey_narrowing[count]), same + downloader.survey_same[count])
+        for (policy, saved) in self.saved.items():
+            saved_total[policy] = saved_total.get(policy, 0) + saved
+        crawls += 1
+
+        # Written next to it first, so an interrupted write does not lose it
+        with open(self.path + ".tmp", "wb") as f:
+            pickle.dump((crawls, children, counts, saved_total), f, protocol=pickle.HIGHEST_PROTOCOL)
+        replace(self.path + ".tmp", self.path)
+        (self.crawls, self.children, self.counts, self.saved_total) = (crawls, children, counts, saved_total)
+
+    def describe(self):
+        return ("Statistics of " + str(self.crawls) + " crawls: " + str(self.saved[ALPHABET])
+                + " child queries left out by their character, " + str(self.saved[RESULT_COUNTS])
+                + " by the result counts they learned")
+
+    def report(self):
+        """What the policies saved over all merged crawls"""
+        return (self.path + " now has " + str(self.crawls) + " crawls. Their statistics saved "
+                + str(sum(self.saved.values())) + " requests in this crawl and "
+                + str(sum(self.saved_total.values())) + " in all of them: "
+                + ", ".join(str(self.saved_total.get(policy, 0)) + " by " + policy
+                            for policy in (ALPHABET, RESULT_COUNTS)))
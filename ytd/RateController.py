@@ -0,0 +1,142 @@
+from collections import deque as Deque
+from threading import Condition
+from time import time
+from email.utils import parsedate_tz, mktime_tz
+
+# Outcomes a fetch reports back to the controller
+OK = 'ok'
+# The server is overloaded or rate limiting us: 429, 5xx, timeouts and dropped connections
+THROTTLED = 'throttled'
+# Any other failure, it says nothing about how fast we may go
+FAILED = 'failed'
+
+def outcome_for_status(status):
+    """Classify a failed fetch, status is None if no http response was received"""
+    if status is None or status == 429 or status >= 500:
+        return THROTTLED
+    return FAILED
+
+def parse_retry_after(value, now=None):
+    """Seconds to wait according to a Retry-After header, or None"""
+    if value is None:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    date = parsedate_tz(value)
+    if date is None:
+        return None
+    if now is None:
+        now = time()
+    return max(0.0, mktime_tz(date) - now)
+
+class RateController:
+    """Token bucket with AIMD concurrency shared by every fetch of a downloader
+
+    While responses are healthy the request rate and the number of requests
+    in flight grow additively. When more than max_throttled of the last
+    window responses were throttled, both are halved at once for all
+    workers and everyone pauses for an exponential back-off. A burst of them
+    only halves once. Throttled responses that are rarer than that are only
+    retried, since random errors do not mean the server is overloaded. A
+    Retry-After always pauses everyone, and every one can make the pause
+    longer.
+    """
+
+    def __init__(self, rate=10.0, max_rate=500.0, concurrency=10, max_concurrency=100):
+        self.rate = float(rate) # requests per second
+        self.min_rate = 0.1
+        self.max_rate = float(max_rate)
+        self.concurrency = float(concurrency)
+        self.max_concurrency = max_concurrency
+        self.in_flight = 0
+        self.tokens = 1.0
+        self.last_refill = time()
+        self.paused_until = 0.0
+        self.backoff = 1.0
+        self.max_backoff = 300.0
+        # A burst of failures from one overload only counts as one decrease
+        self.last_decrease = 0.0
+        self.successes = 0
+        self.throttles = 0
+        # Whether each of the last window responses was throttled
+        self.window = 100
+        self.max_throttled = 0.2
+        self.recent = Deque()
+        self.recent_throttled = 0
+        self.cond = Condition()
+
+    def _reserve(self, now):
+        # Returns 0 if a request may start now, else the time to wait
+        #  or None if we have to wait for a request to finish
+        if now < self.paused_until:
+            return self.paused_until - now
+        if self.in_flight >= max(1, min(int(self.concurrency), self.max_concurrency)):
+            return None
+        self.tokens = min(max(1.0, self.rate), self.tokens + (now - self.last_refill) * self.rate)
+        self.last_refill = now
+        if self.tokens < 1.0:
+            return (1.0 - self.tokens) / self.rate
+        self.tokens -= 1.0
+        self.in_flight += 1
+        return 0
+
+    def acquire(self):
+        """Block until a request may be sent (threaded engine)"""
+        with self.cond:
+            while True:
+                wait = self._reserve(time())
+                if wait == 0:
+                    return
+                self.cond.wait(wait)
+
+    def try_acquire(self):
+        """Non blocking acquire for event loops, see _reserve for the return value"""
+        with self.cond:
+            return self._reserve(time())
+
+    def release(self, outcome, retry_after=None):
+        """Report how a request that was acquired ended"""
+        with self.cond:
+            now = time()
+            self.in_flight -= 1
+            if outcome != FAILED:
+                self._remember(outcome == THROTTLED)
+            if outcome == OK:
+                self.successes += 1
+                self.backoff = 1.0
+                # Additive increase, roughly +1 per round of requests
+                self.concurrency = min(self.max_concurrency, self.concurrency + 1.0 / self.concurrency)
+                self.rate = min(self.max_rate, self.rate + 1.0 / self.rate)
+            elif outcome == THROTTLED:
+                self.throttles += 1
+                wait = parse_retry_after(retry_after, now)
+                if self.recent_throttled > self.max_throttled * self.window and now - self.last_decrease > 1.0:
+                    self.last_decrease = now
+                    self.concurrency = max(1.0, self.concurrency / 2)
+                    self.rate = max(self.min_rate, self.rate / 2)
+                    self.tokens = 0.0
+                    # The next decrease has to be earned by responses at the lower rate
+                    self.recent.clear()
+                    self.recent_throttled = 0
+                    if wait is None:
+                        wait = self.backoff
+                        self.backoff = min(self.max_backoff, self.backoff * 2)
+                # The server can ask for a longer pause than the one that is running
+                if wait is not None:
+                    self.paused_until = max(self.paused_until, now + wait)
+            self.cond.notify_all()
+
+    def _remember(self, throttled):
+        self.recent.append(throttled)
+        self.recent_throttled += throttled
+        if len(self.recent) > self.window:
+            self.recent_throttled -= self.recent.popleft()
+
+    def describe(self):
+        paused = max(0.0, self.paused_until - time())
+        msg = ("Rate: %.1f req/s, concurrency %d/%d, %d in flight, %d throttled responses"
+               % (self.rate, int(self.concurrency), self.max_concurrency, self.in_flight, self.throttles))
+        if paused > 0:
+            msg += ", paused for %.0f seconds" % paused
+        return msg
@@ -0,0 +1,151 @@
+import pickle
+
+from .compat import replace
+from .SimpleSymbolDownloader import general_search_characters
+
+ADDED = "added"
+REMOVED = "removed"
+RENAMED = "renamed"
+
+class Refresher:
+    """Brings a finished download up to date by re-checking a sample of its queries
+
+    Only leaf queries, and narrowed queries whose children are all leaves,
+    are re-checked. The ones whose results changed most often in earlier
+    refreshes go first, that history is kept in <name>.refresh.pickle.
+    A leaf is only descended again if its result count now needs narrowing.
+    """
+
+    def __init__(self, name, downloader, threads=100):
+        self.path = name + ".refresh.pickle"
+        self.downloader = downloader
+        self.threads = threads
+        # query_string -> (times refreshed, times the results changed, last refresh)
+        self.history = {}
+        self.refreshes = 0
+        self.requests = 0
+        try:
+            with open(self.path, "rb") as f:
+                (self.refreshes, self.history) = pickle.load(f)
+        except IOError:
+            pass
+
+    def candidates(self):
+        """Leaf and near-leaf queries, in the order they should be refreshed"""
+        found = []
+        stack = list(self.downloader.master_query.children)
+        while stack:
+            query = stack.pop()
+            if query.num_children == 0:
+                found.append(query)
+                continue
+            stack.extend(query.children)
+            # A narrowed query without results was never fetched, like "0"
+            if query.results and all(child.num_children == 0 for child in query.children):
+                found.append(query)
+        return sorted(found, key=self._priority)
+
+    def _priority(self, query):
+        (refreshed, changed, last) = self.history.get(query.query_string, (0, 0, 0))
+        # The share of refreshes that found changes, starting at one in two,
+        # then the least recently refreshed and the shortest, which cover the most tickers
+        return (-(changed + 1.0) / (refreshed + 2.0), last, len(query.query_string), query.query_string)
+
+    def run(self, budget, insecure=False):
+        """Refresh up to budget queries, plus the queries needed to descend again
+
+        Updates the downloader's symbols and returns the changes as
+        (change, ticker, name, exchange, previous) tuples. previous is the old
+        ticker or name of a renamed symbol.
+        """
+        downloader = self.downloader
+        self.refreshes += 1
+        sample = self.candidates()[:budget]
+        found = {}
+        # Tickers missing from a complete result list they used to be in
+        gone = set()
+        descended = []
+
+        queries = sample
+        while queries:
+            descend = []
+            fetched = downloader.fetchMany([ query.query_string for query in queries ], insecure, self.threads)
+            self.requests += len(queries)
+            for (query, (symbols, count)) in zip(queries, fetched):
+                tickers = [ symbol.ticker for symbol in symbols ]
+                for symbol in symbols:
+                    found[symbol.ticker] = symbol
+                if query.is_done:
+                    (refreshed, changed, last) = self.history.get(query.query_string, (0, 0, 0))
+                    if set(tickers) != set(query.results):
+                        changed += 1
+                    self.history[query.query_string] = (refreshed + 1, changed, self.refreshes)
+                narrow = downloader._needs_narrowing(count)
+                if not narrow:
+                    gone.update(set(query.results) - set(tickers))
+                elif query.query_string.upper() in query.results and query.query_string.upper() not in tickers:
+                    # An exact match is always returned, even if the results are capped
+                    gone.add(query.query_string.upper())
+                query.results = tuple(tickers)
+                if narrow and query.num_children == 0:
+                    # The result count crossed the narrowing threshold
+                    query.is_done = False
+                    query.addChildren(general_search_characters)
+                    descend.extend(query.children)
+                    descended.append(query)
+                else:
+                    query.is_done = True
+            queries = descend
+
+        # Deepest first, so children are complete before their parents
+        for query in reversed(descended):
+            query.num_complete = query.num_children
+            query.children_count = len(self._subtree_tickers(query))
+            query.is_done = True
+            downloader._survey_query(query)
+
+        return self._apply_changes(found, gone)
+
+    def _subtree_tickers(self, query):
+        tickers = set()
+        stack = list(query.children)
+        while stack:
+            child = stack.pop()
+            tickers.update(child.results)
+            stack.extend(child.children)
+        return tickers
+
+    def _apply_changes(self, found, gone):
+        symbols = self.downloader.symbols
+        added = [ symbol for ticker, symbol in sorted(found.items()) if ticker not in symbols ]
+        removed = [ symbols[ticker] for ticker in sorted(gone)
+                    if ticker not in found and ticker in symbols ]
+        changes = []
+
+        # A removed and an added ticker with the same name and exchange are a new ticker
+        removed_by_name = dict(((s.name, s.exchange), s) for s in removed if s.name)
+        for symbol in added:
+            old = removed_by_name.pop((symbol.name, symbol.exchange), None)
+            if old is None:
+                changes.append((ADDED, symbol.ticker, symbol.name, symbol.exchange, None))
+            else:
+                removed.remove(old)
+                del symbols[old.ticker]
+                changes.append((RENAMED, symbol.ticker, symbol.name, symbol.exchange, old.ticker))
+            symbols[symbol.ticker] = symbol
+        for symbol in removed:
+            del symbols[symbol.ticker]
+            changes.append((REMOVED, symbol.ticker, symbol.name, symbol.exchange, None))
+
+        for ticker, symbol in sorted(found.items()):
+            old = symbols.get(ticker)
+            if old is not symbol and old.name != symbol.name:
+                changes.append((RENAMED, ticker, symbol.name, symbol.exchange, old.name))
+            symbols[ticker] = symbol
+        return changes
+
+    def save(self):
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            pickle.dump((self.refreshes, self.history), f, protocol=pickle.HIGHEST_PROTOCOL)
+        replace(tmp_path, self.path)
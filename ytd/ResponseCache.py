@@ -0,0 +1,103 @@
+import sqlite3
+from threading import Lock
+from time import time
+
+from .compat import json_loads
+
+schema = """
+CREATE TABLE IF NOT EXISTS responses (
+    host TEXT,
+    term TEXT,
+    fetched REAL,
+    body BLOB,
+    PRIMARY KEY (host, term)
+);
+CREATE INDEX IF NOT EXISTS responses_fetched ON responses (fetched);
+"""
+
+def normalize(term):
+    return term.strip().lower()
+
+class ResponseCache:
+    """Search responses kept in <name>.cache.sqlite, so later runs can reuse them
+
+    A response is used for ttl seconds after it was fetched. When the
+    responses take more than max_size bytes, the oldest ones are dropped.
+    Writes are committed every commit_every responses and on flush().
+    """
+
+    def __init__(self, name, ttl=7 * 24 * 3600, max_size=1024 * 1024 * 1024, commit_every=1000):
+        self.path = name + ".cache.sqlite"
+        self.ttl = ttl
+        self.max_size = max_size
+        self.commit_every = commit_every
+        self.lock = Lock()
+        self.db = sqlite3.connect(self.path, check_same_thread=False)
+        self.db.executescript(schema)
+        self.size = self.db.execute("SELECT COALESCE(SUM(length(body)), 0) FROM responses").fetchone()[0]
+        if self.size > self.max_size:
+            # max_size is smaller than in an earlier run
+            self._evict()
+            self.db.commit()
+        self.uncommitted = 0
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+
+    def get(self, host, term):
+        """The decoded response for term, or None if there is no fresh one"""
+        with self.lock:
+            row = self.db.execute("SELECT fetched, body FROM responses WHERE host = ? AND term = ?",
+                                  (host, normalize(term))).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            if row[0] < time() - self.ttl:
+                self.stale += 1
+                return None
+            self.hits += 1
+        return json_loads(bytes(row[1]))
+
+    def put(self, host, term, body):
+        with self.lock:
+            key = (host, normalize(term))
+            row = self.db.execute("SELECT length(body) FROM responses WHERE host = ? AND term = ?", key).fetchone()
+            if row is not None:
+                self.size -= row[0]
+            self.db.execute("INSERT OR REPLACE INTO responses (host, term, fetched, body) VALUES (?, ?, ?, ?)",
+                            key + (time(), sqlite3.Binary(body)))
+            self.size += len(body)
+            if self.size > self.max_size:
+                self._evict()
+            self.uncommitted += 1
+            if self.uncommitted >= self.commit_every:
+                self._commit()
+
+    def _evict(self):
+        # Down to 90% so this does not run again for every response
+        while self.size > self.max_size * 0.9:
+            rows = self.db.execute("SELECT host, term, length(body) FROM responses"
+                                   " ORDER BY fetched LIMIT 1000").fetchall()
+            if not rows:
+                break
+            for (host, term, length) in rows:
+                self.db.execute("DELETE FROM responses WHERE host = ? AND term = ?", (host, term))
+                self.size -= length
+                if self.size <= self.max_size * 0.9:
+                    break
+
+    def _commit(self):
+        self.db.commit()
+        self.uncommitted = 0
+
+    def flush(self):
+        with self.lock:
+            self._commit()
+
+    def close(self):
+        self.flush()
+        self.db.close()
+
+    def describe(self):
+        return ("Cache: %d hits, %d misses, %d stale, %.1f MB"
+                % (self.hits, self.misses, self.stale, self.size / (1024.0 * 1024)))
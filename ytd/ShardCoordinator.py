@@ -0,0 +1,287 @@
+import os
+import pickle
+import socket
+from threading import Lock, Event, Thread
+from time import time, sleep
+from multiprocessing.managers import BaseManager
+
+from .compat import quote, replace
+from .Journal import Journal
+from .FrontierPruner import FrontierPruner
+from .ResponseCache import ResponseCache
+from .ConnectionManager import parse_route
+from .SimpleSymbolDownloader import first_search_characters, general_search_characters
+
+def shard_prefixes(depth=1):
+    """The prefixes the crawl is split on, one shard each
+
+    The prefixes shorter than depth are leaf shards that fetch just that
+    query, the shards of their children do the rest.
+    """
+    prefixes = list(first_search_characters)
+    leaves = []
+    for i in range(depth - 1):
+        # "0" isn't valid alone as a search string
+        leaves.extend(p for p in prefixes if p != "0")
+        prefixes = [ p + c for p in prefixes for c in general_search_characters ]
+    return leaves + prefixes
+
+def parse_address(address):
+    (host, port) = address.rsplit(':', 1)
+    return (host, int(port))
+
+def _shard_name(name, prefix):
+    return name + ".shard-" + quote(prefix, safe='')
+
+class ShardCoordinator:
+    """Hands out shards of the prefix space to workers and merges what they found
+
+    Workers claim a prefix, crawl it with their own downloader and journal,
+    and send the symbols and query tree back when done. Finished shards are
+    kept in <name>.shards/ so a restarted coordinator only hands out what is
+    left. A shard whose worker failed, or did not report for lease seconds,
+    is handed out again; only that shard is redone.
+    """
+
+    def __init__(self, name, prefixes, lease=3600):
+        self.directory = name + ".shards"
+        self.prefixes = list(prefixes)
+        # Shorter prefixes are leaf shards, see shard_prefixes()
+        self.depth = max(len(prefix) for prefix in self.prefixes)
+        self.lease = lease
+        self.lock = Lock()
+        self.finished = Event()
+        self.running = {} # prefix -> (worker, time of last report)
+        self.pending = []
+        self.completed = set()
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        for prefix in self.prefixes:
+            if os.path.exists(self._path(prefix)):
+                self.completed.add(prefix)
+            else:
+                self.pending.append(prefix)
+        self._check_finished()
+
+    def _path(self, prefix):
+        return os.path.join(self.directory, quote(prefix, safe='') + ".pickle")
+
+    def _check_finished(self):
+        if len(self.completed) == len(self.prefixes):
+            self.finished.set()
+
+    def _expire_leases(self):
+        now = time()
+        for prefix, (worker, seen) in list(self.running.items()):
+            if now - seen > self.lease:
+                print("Shard " + prefix + " timed out on " + worker + ", handing it out again")
+                del self.running[prefix]
+                self.pending.insert(0, prefix)
+
+    def claim(self, worker):
+        """The next prefix to crawl, '' if there is none right now or None when all are done"""
+        with self.lock:
+            self._expire_leases()
+            if self.finished.is_set():
+                return None
+            if not self.pending:
+                return ''
+            prefix = self.pending.pop(0)
+            self.running[prefix] = (worker, time())
+            print("Shard " + prefix + " handed to " + worker)
+            return prefix
+
+    def is_leaf(self, prefix):
+        return len(prefix) < self.depth
+
+    def heartbeat(self, prefix, worker):
+        """Returns False if the worker lost the shard and should stop crawling it"""
+        with self.lock:
+            if self.running.get(prefix, (None,))[0] != worker:
+                return False
+            self.running[prefix] = (worker, time())
+            return True
+
+    def fail(self, prefix, worker):
+        with self.lock:
+            if self.running.get(prefix, (None,))[0] == worker:
+                print("Shard " + prefix + " failed on " + worker + ", handing it out again")
+                del self.running[prefix]
+                self.pending.insert(0, prefix)
+
+    def abandon(self, worker):
+        """Hands out again the shards of a worker that is known to be gone"""
+        with self.lock:
+            for prefix, (running, seen) in list(self.running.items()):
+                if running == worker:
+                    print("Shard " + prefix + " was left by " + worker + ", handing it out again")
+                    del self.running[prefix]
+                    self.pending.insert(0, prefix)
+
+    def complete(self, prefix, worker, result):
+        with self.lock:
+            if prefix in self.completed:
+                return
+            tmp_path = self._path(prefix) + ".tmp"
+            with open(tmp_path, "wb") as f:
+                pickle.dump(result, f, protocol=pickle.HIGHEST_PROTOCOL)
+            replace(tmp_path, self._path(prefix))
+            self.running.pop(prefix, None)
+            if prefix in self.pending:
+                self.pending.remove(prefix)
+            self.completed.add(prefix)
+            print("Shard " + prefix + " completed by " + worker + ": "
+                  + str(len(self.completed)) + "/" + str(len(self.prefixes)) + " shards done")
+            self._check_finished()
+
+    def status(self):
+        with self.lock:
+            return ("Shards: " + str(len(self.completed)) + " done, " + str(len(self.running))
+                    + " running, " + str(len(self.pending)) + " pending")
+
+    def merge(self, downloader_class):
+        """A finished downloader with the symbols and query trees of all shards"""
+        downloader = downloader_class()
+        downloader.setPrefixes([])
+        master = downloader.master_query
+        children = []
+        for prefix in self.prefixes:
+            with open(self._path(prefix), "rb") as f:
+                result = pickle.load(f)
+            # Shards can overlap, a ticker is only kept once
+            downloader.symbols.update(result['symbols'])
+            for query in result['queries']:
+                query.parent = master
+                children.append(query)
+            downloader.completed_queries.extend(result['completed_queries'])
+            for i in range(len(downloader.survey_same)):
+                downloader.survey_narrowing[i] = downloader.survey_narrowing[i] or result['survey_narrowing'][i]
+                downloader.survey_same[i] += result['survey_same'][i]
+        master.children = children
+        master.num_children = master.num_complete = len(children)
+        master.is_done = True
+        downloader.done = True
+        downloader.querySurvey()
+        return downloader
+
+def serve(coordinator, address, authkey):
+    """Makes the coordinator reachable by workers, in a background thread"""
+    class CoordinatorManager(BaseManager):
+        pass
+    CoordinatorManager.register('coordinator', callable=lambda: coordinator)
+    server = CoordinatorManager(address=address, authkey=authkey).get_server()
+    t = Thread(target=server.serve_forever)
+    t.daemon = True
+    t.start()
+    return server
+
+class CoordinatorClient(BaseManager):
+    pass
+CoordinatorClient.register('coordinator')
+
+def worker_name(pid):
+    return socket.gethostname() + ":" + str(pid)
+
+def open_engine(downloader_class, options):
+    """A downloader whose fetch engine, connections and rate limit all shards of a worker share
+
+    options are those of the command line the shards are crawled with, see run_worker().
+    """
+    engine = downloader_class()
+    engine.setPrefixes([])
+    if options.get('rate') is not None:
+        engine.rate_controller.rate = options['rate']
+    if options.get('max_rate') is not None:
+        engine.rate_controller.max_rate = options['max_rate']
+    if options.get('routes'):
+        engine.connections.routes = [ parse_route(spec) for spec in options['routes'] ]
+    if options.get('engine') == "async":
+        from .AsyncEngine import AsyncEngine
+        engine.engine = AsyncEngine(engine, options.get('concurrency', 500))
+    return engine
+
+def close_engine(engine):
+    if engine.engine is not None:
+        engine.engine.close()
+    engine.connections.close()
+
+def crawl_shard(downloader_class, name, prefix, coordinator, worker, engine, options, leaf=False):
+    """Crawls one shard, resuming from its journal if this host crawled it before
+
+    engine is the downloader from open_engine() that fetches for it.
+    A leaf shard only fetches prefix itself.
+    """
+    downloader = downloader_class()
+    downloader.setPrefixes([ prefix ])
+    downloader.shareEngine(engine)
+    if options.get('host') is not None:
+        downloader.host = options['host']
+    downloader.quiet = options.get('quiet', False)
+    if leaf:
+        # Its children are shards of their own
+        downloader.result_count_action = [ False ] * len(downloader.result_count_action)
+    if options.get('prune'):
+        downloader.pruner = FrontierPruner()
+    journal = Journal(_shard_name(name, prefix))
+    try:
+        journal.load(downloader)
+    except IOError:
+        pass
+    if options.get('cache'):
+        # One per shard, workers on one host do not share it
+        downloader.cache = ResponseCache(_shard_name(name, prefix), options['cache_ttl'], options['cache_size'])
+
+    try:
+        while not downloader.isDone():
+            downloader.nextRequest(lambda symbols: None, options.get('insecure', False))
+            journal.append(downloader)
+            print("Shard " + prefix + ":")
+            downloader.printProgress()
+            if not coordinator.heartbeat(prefix, worker):
+                print("Shard " + prefix + " was handed to another worker")
+                return None
+        journal.compact(downloader)
+    finally:
+        if downloader.cache is not None:
+            downloader.cache.close()
+
+    return {
+        'symbols': downloader.symbols,
+        'queries': downloader.master_query.children,
+        'completed_queries': downloader.completed_queries,
+        'survey_narrowing': downloader.survey_narrowing,
+        'survey_same': downloader.survey_same,
+    }
+
+def run_worker(address, authkey, downloader_class, name, options=None):
+    """Crawls shards handed out by the coordinator at address until all are done
+
+    options is a dict of the command line options the shards are crawled
+    with: insecure, rate, max_rate, host, routes, quiet, engine,
+    concurrency, prune, and cache with cache_ttl and cache_size.
+    """
+    options = options or {}
+    client = CoordinatorClient(address=address, authkey=authkey)
+    client.connect()
+    coordinator = client.coordinator()
+    worker = worker_name(os.getpid())
+    engine = open_engine(downloader_class, options)
+    try:
+        while True:
+            prefix = coordinator.claim(worker)
+            if prefix is None:
+                return
+            if prefix == '':
+                # The remaining shards are being crawled by others, one may fail
+                sleep(10)
+                continue
+            try:
+                result = crawl_shard(downloader_class, name, prefix, coordinator, worker, engine, options,
+                                     coordinator.is_leaf(prefix))
+            except:
+                coordinator.fail(prefix, worker)
+                raise
+            if result is not None:
+                coordinator.complete(prefix, worker, result)
+    finally:
+        close_engine(engine)
@@ -1,14 +1,18 @@
-import requests
+import signal
 import string
-from time import sleep
-import math
 
 from ytd.compat import text
 from ytd.compat import quote
+from ytd.compat import json_loads
 
-from Query import Query
+from .Query import Query
+from .Frontier import StagedFrontier, SpillFrontier
+from .RateController import RateController, outcome_for_status, OK, FAILED
+from .Metrics import Metrics
+from .ConnectionManager import ConnectionManager
 
-from threading import Thread
+from threading import Thread, Lock
+from time import time
 from collections import deque as Deque
 from ytd.compat import is_py3
 if is_py3:
@@ -16,24 +20,123 @@ if is_py3:
 else:
     from Queue import Queue
 
+class _InterruptDeferred:
+    """Holds back a Ctrl-C that comes while a result is applied, until it is
+
+    A result is applied whole or not at all, a checkpoint of a half applied
+    one could have the children of a query that is still in flight. The
+    handler is installed for a whole batch, applying a result only sets a
+    flag.
+    """
+
+    def __init__(self):
+        self.applying = False
+        self.interrupted = False
+        self.previous = None
+
+    def __enter__(self):
+        try:
+            previous = signal.signal(signal.SIGINT, self._handle)
+        except ValueError:
+            # Not the main thread, which is the only one that gets signals
+            return self
+        if callable(previous):
+            self.previous = previous
+        else:
+            # Ignored or left to the OS, there is no KeyboardInterrupt to hold back
+            signal.signal(signal.SIGINT, previous)
+        return self
+
+    def _handle(self, signum, frame):
+        if self.applying:
+            self.interrupted = True
+        else:
+            self.previous(signum, frame)
+
+    def applied(self):
+        self.applying = False
+        if self.interrupted and self.previous is not None:
+            self.interrupted = False
+            self.previous(signal.SIGINT, None)
+
+    def __exit__(self, kind, value, traceback):
+        if self.previous is not None:
+            signal.signal(signal.SIGINT, self.previous)
+            self.previous = None
+
+# One for every downloader, a shared engine applies the results of several
+_interrupts = _InterruptDeferred()
+
 user_agent = 'yahoo-ticker-symbol-downloader'
+search_host = 'finance.yahoo.com'
+search_path = '/_finance_doubledown/api/resource/searchassist'
+search_params = {
+    'device': 'console',
+    'returnMeta': 'true',
+}
 general_search_characters = 'abcdefghijklmnopqrstuvwxyz0123456789.='
 first_search_characters = 'abcdefghijklmnopqrstuvwxyz1234567890'
 
 class SymbolDownloader:
     """Abstract class"""
 
-    def __init__(self, type):
+    def __init__(self, type, prefixes=first_search_characters):
+        # prefixes are the first queries, see setPrefixes()
         # All downloaded symbols are stored in a dict before exporting
         # This is to ensure no duplicate data
         self.symbols = {}
-        self.rsession = requests.Session()
         self.type = type
-        self.current_queries = None
+        # Another host serving the same API, like a ytd.FakeServer
+        self.host = search_host
+        # Queries taken from the frontier that were not processed yet,
+        # they stay in flight from one batch to the next
+        self.current_queries = []
+        # In flight queries restored from a checkpoint, they are sent again first
+        self.resend = Deque()
         self.completed_queries = []
         self.done = False
         self.insecure = None
         self.status_print = None
+        self.batch_taken = []
+        self.batch_results = []
+        self.batch_symbols = {}
+        self.batch_done = []
+        # A batch ends after this many results, which is when it can be checkpointed
+        self.batch_size = 2000
+        # None means the threaded engine below, anything else must provide run(batch_size)
+        # (See ytd.AsyncEngine)
+        self.engine = None
+        self.workers = 100
+        self.workers_started = False
+        # The downloader whose engine this one uses, see shareEngine()
+        self.shared_with = None
+        # Queries handed to the fetch workers at any time, more than there are
+        # workers so they have a next one while a batch is being checkpointed
+        self.max_in_flight = 2 * self.workers
+        self.in_flight = 0
+        # HTTP sessions, one per route to the search API, shared by all workers
+        self.connections = ConnectionManager(pool_size=self.workers)
+        # For the share of the time the workers (or async slots) had a query
+        self.busy_lock = Lock()
+        self.busy_seconds = 0.0
+        self.busy_mark = (time(), 0.0)
+        self.utilization = None
+        # The same for the single thread applying results, see _apply_fetch
+        self.apply_seconds = 0.0
+        self.apply_count = 0
+        self.apply_mark = (0.0, 0)
+        self.writer_utilization = None
+        self.writer_capacity = None
+        # Every fetch, of any engine, goes through this
+        self.rate_controller = RateController()
+        # None fetches every child query, see ytd.FrontierPruner
+        self.pruner = None
+        # None learns nothing from earlier crawls, see ytd.QueryStats
+        self.stats = None
+        # None sends every search, see ytd.ResponseCache
+        self.cache = None
+        # True leaves out the output of every single request
+        self.quiet = False
 
         # Attempt to deal with API results < 10 not containing all results
         # Assume if results = 10 then there are more
@@ -49,64 +152,153 @@ class SymbolDownloader:
             # for a result count of 10, True means we know it's incomplete
             True ]
 
-        # In stage 1, queries are processed FIFO
-        # After stage 1, queries are processed LIFO
-        self.stage1 = True
+        # Result count statistics of done queries that were narrowed, kept up
+        # to date as queries finish so querySurvey does not walk the tree
+        # survey_narrowing[count] is True if narrowing found more results
+        # survey_same[count] is how often narrowing found the same number of results
+        self.survey_narrowing = [ False ] * len(self.result_count_action)
+        self.survey_same = [ 0 ] * len(self.result_count_action)
 
         # instantiate the queues
-        self.queries = Deque()
+        # The queries still to fetch, FIFO at first and LIFO later unless
+        #  setFrontier() changes that (See ytd.Frontier)
+        self.queries = StagedFrontier()
         # The queue of queries to be fetched by the threaded downloaders
         #  queries are worked in batches so the downloader state can be saved occasionally
         self.fetch_jobs = Queue()
-        # The queue of completed fetches that need to be processed
-        # A blocking queue is used for this as well
-        self.fetch_returns = Queue()
-        
+        # The queue of decoded fetches waiting for the thread that applies them
+        # It is bounded, the workers wait when the writer falls behind
+        self.fetch_returns = Queue(self.max_in_flight)
+
+        self.metrics = Metrics()
+        self.metrics.gauge("fetch_jobs", lambda: self.fetch_jobs.qsize(), "Queries waiting for a fetch worker")
+        self.metrics.gauge("fetch_returns", lambda: self.fetch_returns.qsize(), "Responses waiting to be processed")
+        self.metrics.gauge("frontier", lambda: len(self.queries), "Queries not taken yet")
+        self.metrics.gauge("completed_queries", lambda: len(self.completed_queries), "Queries with a result")
+        self.metrics.gauge("symbols", lambda: len(self.symbols), "Unique symbols collected")
+        self.metrics.gauge("rate", lambda: self.rate_controller.rate, "Requests per second the rate controller allows")
+        self.metrics.gauge("in_flight", lambda: self.rate_controller.in_flight, "Requests sent and not answered yet")
+        self.metrics.gauge("worker_utilization", lambda: self.utilization,
+                           "Share of the time the workers had a query during the last batch")
+        self.metrics.gauge("writer_utilization", lambda: self.writer_utilization,
+                           "Share of the time the writer applied results during the last batch")
+        self.metrics.gauge("throttles", lambda: self.rate_controller.throttles, "Throttled responses")
+        self.metrics.gauge("healthy_routes", lambda: self.connections.healthy(), "Routes to the search API that are not skipped")
+
+        self.setPrefixes(prefixes)
+
+    def setPrefixes(self, prefixes):
+        """Start from these first queries instead, before anything was fetched
+
+        Subclasses are made without arguments, a shard of the crawl is
+        started from just some prefixes this way (See ytd.ShardCoordinator).
+        """
+        self.queries = StagedFrontier()
+        self.completed_queries = []
         # instantiate the "master" query
         self.master_query = Query('', None)
         # put the first real queries in the queue
-        self._add_queries(self.master_query, first_search_characters)
+        self._add_queries(self.master_query, prefixes)
         # "0" isn't valid alone as a search string
-        #self._add_queries(self.master_query, '0')
-        q= self.queries.pop()
-        if q.query_string != "0":
-            sys.exit("not 0")
-        self._add_queries(q, general_search_characters)
-        self.completed_queries.append(q)
-
-        # instantiate workers
-        # First the multiple http fetchers
-        for x in range(100):
+        for q in self.master_query.children:
+            if q.query_string == "0":
+                self.queries.remove(q)
+                self._add_queries(q, general_search_characters)
+                self.completed_queries.append(q)
+
+    def _start_workers(self):
+        # Workers are started on the first threaded batch,
+        # so no threads are created when a different engine is used
+        if self.shared_with is not None:
+            return self.shared_with._start_workers()
+        if self.workers_started:
+            return
+        self.workers_started = True
+        # instantiate workers, the http fetchers
+        # Fetch returns are processed by the thread calling nextRequest
+        for x in range(self.workers):
             t = Thread(target=self._fetch_worker)
             t.daemon = True
             t.start()
-        # there is a single instance to process fetch returns
-        # it is a thread so it can work while all the fetchers are idle
-        t = Thread(target=self._fetch_processor)
-        t.daemon = True
-        t.start()
+
+    def shareEngine(self, other):
+        """Fetch with the workers or async engine, the connections and the rate
+        controller of other, a downloader of another type
+
+        Each keeps its own queries and results. They should take turns with
+        a batch each, the queries of the others that are still in flight
+        are fetched meanwhile.
+        """
+        while other.shared_with is not None:
+            other = other.shared_with
+        self.shared_with = other
+        self.fetch_jobs = other.fetch_jobs
+        self.workers = other.workers
+        self.connections = other.connections
+        self.rate_controller = other.rate_controller
+        self.engine = other.engine
 
     def save_state(self):
+        # The last element says current_queries are the ones in flight,
+        # before that they were the whole batch
         return [ self.symbols, self.current_queries, self.completed_queries, self.done,
-                 self.queries, self.master_query,  self.result_count_action, self.stage1 ]
+                 self.queries, self.master_query,  self.result_count_action, self.queries.stage1,
+                 self.survey_narrowing, self.survey_same, self.pruner, True, self.stats ]
 
     def restore_state(self, downloader_data):
         (self.symbols, current_queries, self.completed_queries, self.done,
-         self.queries, self.master_query, self.result_count_action, self.stage1) = downloader_data
-        if self.stage1:
-            self.queries.extendleft(current_queries)
+         self.queries, self.master_query, self.result_count_action, stage1) = downloader_data[:8]
+        if isinstance(self.queries, Deque):
+            # Saved before there were frontiers to choose from
+            self.queries = StagedFrontier(self.queries, stage1)
+        if len(downloader_data) > 8:
+            (self.survey_narrowing, self.survey_same) = downloader_data[8:10]
         else:
-            self.queries.extend(current_queries)
+            # Saved before the statistics were kept
+            self.descendQueries(self.master_query)
+        if len(downloader_data) > 10:
+            self.pruner = downloader_data[10]
+            if self.pruner is not None:
+                self.pruner.rebuild(self.symbols.values())
+        # None if it was saved again before its first batch
+        current_queries = current_queries or []
+        self.in_flight = 0
+        if len(downloader_data) > 11:
+            self.current_queries = current_queries
+            self.resend = Deque(current_queries)
+        else:
+            # An interrupted batch of an older version, it is redone
+            self.queries.putBack(current_queries)
+            self.current_queries = []
+            self.resend = Deque()
+        if len(downloader_data) > 12:
+            self.stats = downloader_data[12]
 
-    def _add_queries(self, query, search_characters):
+    def _add_queries(self, query, search_characters, novel=0):
         # This method will add child queries to query and put the children in the queue
         # Each child query will have an additional character appended to the parent query string
         #  (taken from search_characters)
+        # novel is how many of query's results were new symbols
+        if self.stats is not None:
+            search_characters = self.stats.select(query, search_characters)
+        if self.pruner is not None:
+            search_characters = self.pruner.select(query, search_characters)
         query.addChildren(search_characters)
-        if self.stage1:
-            self.queries.extend(query.children)
-        else:
-            self.queries.extend(query.children[::-1])
+        self.queries.add(query, query.children, novel, self._guessed(query))
+
+    def _guessed(self, query):
+        # Whether query was narrowed without knowing if its result count needs it
+        return self.result_count_action[len(query.results)] is None
+
+    def setFrontier(self, frontier):
+        # Moves the queries still to fetch to another kind of frontier
+        if isinstance(self.queries, SpillFrontier):
+            # The queries it reads back from its files are not the children of their parents
+            raise ValueError("The queries of a frontier that spills to " + self.queries.path
+                             + " can not be moved to another frontier")
+        for query in self.queries:
+            frontier.add(query.parent, [ query ], 0, self._guessed(query.parent))
+        self.queries = frontier
 
     def _encodeParams(self, params):
         encoded = ''
@@ -114,128 +306,377 @@ class SymbolDownloader:
             encoded += ';' + quote(key) + '=' + quote(text(value))
         return encoded
 
-    def _fetch(self, insecure, query_string):
+    def _fetch_url(self, insecure, query_string, host=None):
+        # The url without the query part, shared by all engines
         params = {
             'searchTerm': query_string,
         }
-        query_string = {
-            'device': 'console',
-            'returnMeta': 'true',
-        }
         protocol = 'http' if insecure else 'https'
+        return protocol + '://' + (host or self.host) + search_path + self._encodeParams(params)
+
+    def _fetch(self, insecure, query_string, route):
+        # Imported on the first request, exports and resumes start faster without it
+        import requests
         req = requests.Request('GET',
-            protocol+'://finance.yahoo.com/_finance_doubledown/api/resource/searchassist'+self._encodeParams(params),
+            self._fetch_url(insecure, query_string, route.host),
             headers={'User-agent': user_agent},
-            params=query_string
+            params=search_params
         )
         req = req.prepare()
         msg = "req " + req.url
-        resp = self.rsession.send(req, timeout=(12, 12))
+        resp = self.connections.send(route, req, (12, 12))
         resp.raise_for_status()
+        json = json_loads(resp.content)
+        self._cache_response(query_string, resp.content)
 
-        return [ resp.json(), msg ]
+        return [ json, msg ]
+
+    def _fetch_cached(self, query_string):
+        # A fresh answer from the cache skips the network and the rate controller
+        if self.cache is None:
+            return None
+        json = self.cache.get(self.host, query_string)
+        if json is None:
+            return None
+        self.metrics.count("cached_total")
+        return [ json, "cached " + query_string ]
+
+    def _cache_response(self, query_string, body):
+        if self.cache is not None:
+            self.cache.put(self.host, query_string, body)
 
     def decodeSymbolsContainer(self, symbolsContainer):
         raise Exception("Function to extract symbols must be overwritten in subclass. Generic symbol downloader does not know how.")
 
+    def _known_symbol(self, ticker):
+        # The stored symbol, which decodeSymbolsContainer can return again if
+        # nothing changed. Only for symbols kept in memory, looking one up in
+        # a ytd.SqliteStore costs more than a new object.
+        if isinstance(self.symbols, dict):
+            return self.symbols.get(ticker)
+        return None
+
+    def _take(self):
+        # Pops the next query from the frontier.
+        # This must stay deterministic, journal replay depends on it.
+        query = self.queries.take()
+        self.current_queries.append(query)
+        # Where it was taken between the results, see journal_record()
+        self.batch_taken.append((query.query_string, len(self.batch_results)))
+        return query
+
+    def _next_queries(self, limit):
+        # Up to limit queries to send, restored ones before new ones
+        queries = []
+        while len(queries) < limit:
+            if self.resend:
+                queries.append(self.resend.popleft())
+            elif self.queries:
+                queries.append(self._take())
+            else:
+                break
+        return queries
+
+    def _start_batch(self):
+        # What the batch did, in the order it was processed. See journal_record()
+        self.batch_taken = []
+        self.batch_results = []
+        self.batch_symbols = {}
+        self.batch_done = []
+        # Between batches, see ytd.Frontier.SpillFrontier
+        self.queries.spill()
+
     def nextRequest(self, status_print, insecure=False, pandantic=False):
+        # Fetches and processes queries until batch_size results are in or
+        # nothing is left. The queries in flight at that point stay in flight,
+        # the workers keep fetching them while the batch is checkpointed.
         self.status_print = status_print
         self.insecure = insecure
-        # not threading, so blocking is irrelevant
-        if self.stage1:
-            # switch to LIFO when there are 2500 staged queries
-            if len(self.queries) >= 2000:
-                self.stage1 = False
-            q = self.queries.popleft()
-            self.current_queries = [ q ]
-            self.fetch_jobs.put(q)
-        else:
-            self.current_queries = []
-            for x in range(2000):
-                if len(self.queries) > 0:
-                    q = self.queries.pop()
-                    self.current_queries.append(q)
-                    self.fetch_jobs.put(q)
-
-        #json = self._fetch_worker(insecure, self.current_query)
-        self.fetch_jobs.join()
+        self._start_batch()
 
-        #symbols = self._fetch_processor(self.current_query, json)
-        self.fetch_returns.join()
-        self.current_queries = []
+        with _interrupts:
+            if self.engine is None:
+                self._run_batch()
+            else:
+                self.engine.run(self.batch_size, self)
+        if self.cache is not None:
+            self.cache.flush()
 
         self.querySurvey()
+        self._measure_utilization()
 
-        if len(self.queries) == 0:
+        if len(self.queries) == 0 and not self.current_queries:
             self.done = True
         else:
             self.done = False
 
+    def _run_batch(self):
+        self._start_workers()
+        processed = 0
+        while True:
+            for query in self._next_queries(self.max_in_flight - self.in_flight):
+                self.in_flight += 1
+                # The workers can be shared by downloaders of other types
+                self.fetch_jobs.put((self, query))
+            if self.in_flight == 0 or processed >= self.batch_size:
+                return
+            (current_query, decoded, msg, error) = self.fetch_returns.get()
+            self.in_flight -= 1
+            if error is not None:
+                raise error
+            self._apply_fetch(current_query, decoded, msg)
+            processed += 1
+
     def _fetch_worker(self):
         while True:
-            current_query = self.fetch_jobs.get()
-            success = False
-            retryCount = 0
-            json = None
-            # Eponential back-off algorithm
-            # to attempt 5 more times sleeping 5, 25, 125, 625, 3125 seconds
-            # respectively.
-            maxRetries = 10
-            while(success == False):
-                try:
-                    (json, msg) = self._fetch(self.insecure, current_query.query_string)
-                    success = True
-                except (requests.HTTPError,
-                        requests.exceptions.ChunkedEncodingError,
-                        requests.exceptions.ReadTimeout,
-                        requests.exceptions.ConnectionError) as ex:
-                    if retryCount < maxRetries:
-                        attempt = retryCount + 1
-                        sleepAmt = int(math.pow(5,attempt))
-                        print("Retry attempt: " + str(attempt) + " of " + str(maxRetries) + "."
-                              " Sleep period: " + str(sleepAmt) + " seconds.")
-                        sleep(sleepAmt)
-                        retryCount = attempt
-                    else:
-                        raise
-            self.fetch_returns.put([current_query, json, msg])
-            self.fetch_jobs.task_done()
-
-    def _fetch_processor(self):
+            (downloader, current_query) = self.fetch_jobs.get()
+            start = time()
+            try:
+                (json, msg) = downloader._fetch_with_retries(downloader.insecure, current_query.query_string)
+                decoded = downloader._decode(json)
+            except Exception as ex:
+                # Raised again by nextRequest, the query stays in flight
+                (decoded, msg, error) = (None, None, ex)
+            else:
+                error = None
+            downloader._add_busy(time() - start)
+            downloader.fetch_returns.put([current_query, decoded, msg, error])
+
+    def _add_busy(self, seconds):
+        with self.busy_lock:
+            self.busy_seconds += seconds
+
+    def _measure_utilization(self):
+        # Since the end of the last batch, so the checkpoint in between counts too
+        now = time()
+        slots = self.workers if self.engine is None else self.engine.concurrency
+        with self.busy_lock:
+            (then, busy) = self.busy_mark
+            self.busy_mark = (now, self.busy_seconds)
+            if now > then:
+                self.utilization = min(1.0, (self.busy_seconds - busy) / ((now - then) * slots))
+                (seconds, count) = self.apply_mark
+                self.apply_mark = (self.apply_seconds, self.apply_count)
+                self.writer_utilization = min(1.0, (self.apply_seconds - seconds) / (now - then))
+                if self.apply_seconds > seconds:
+                    # The most results per second the writer could apply
+                    self.writer_capacity = (self.apply_count - count) / (self.apply_seconds - seconds)
+
+    def _fetch_with_retries(self, insecure, query_string):
+        cached = self._fetch_cached(query_string)
+        if cached is not None:
+            return cached
+        import requests
+        retryCount = 0
+        # Back-off is done by the shared rate controller, a throttled
+        # response pauses all workers instead of just this one
+        maxRetries = 10
         while True:
-            (current_query, json, msg) = self.fetch_returns.get()
-            (symbols, count) = self.decodeSymbolsContainer(json)
+            self.rate_controller.acquire()
+            route = self.connections.choose()
+            start = time()
+            # Released however the request ends, a leaked slot in flight is never given back
+            (outcome, retry_after) = (FAILED, None)
+            try:
+                result = self._fetch(insecure, query_string, route)
+                outcome = OK
+            except (requests.HTTPError,
+                    requests.exceptions.ChunkedEncodingError,
+                    requests.exceptions.ReadTimeout,
+                    requests.exceptions.ConnectionError) as ex:
+                resp = ex.response
+                if resp is None:
+                    outcome = outcome_for_status(None)
+                    self.metrics.count("requests_total", status=type(ex).__name__)
+                    self._route_failed(route)
+                else:
+                    outcome = outcome_for_status(resp.status_code)
+                    retry_after = resp.headers.get('Retry-After')
+                    self.connections.succeeded(route)
+                    self.metrics.count("requests_total", status=resp.status_code)
+                if outcome == FAILED or retryCount >= maxRetries:
+                    # Other 4xx responses do not change by asking again
+                    raise
+                self.metrics.count("retries_total", error=type(ex).__name__)
+                retryCount += 1
+                print("Retry attempt: " + str(retryCount) + " of " + str(maxRetries) + ".")
+            finally:
+                self.metrics.observe("request_seconds", time() - start)
+                self.rate_controller.release(outcome, retry_after)
+            if outcome == OK:
+                self.metrics.count("requests_total", status=200)
+                self.connections.succeeded(route)
+                return result
+
+    def _route_failed(self, route):
+        # A request on route got no response, for every engine
+        self.metrics.count("route_errors_total", route=route.name())
+        if self.connections.failed(route) and len(self.connections.routes) > 1:
+            print("Route " + route.name() + " is failing, using the others for a while")
+
+    def fetchMany(self, query_strings, insecure=False, threads=100):
+        """Fetch and decode queries outside of the crawl, returns (symbols, count) for each"""
+        pending = Deque(enumerate(query_strings))
+        results = [ None ] * len(query_strings)
+        errors = []
+
+        def work():
+            while not errors:
+                try:
+                    (i, query_string) = pending.popleft()
+                except IndexError:
+                    return
+                try:
+                    (json, msg) = self._fetch_with_retries(insecure, query_string)
+                    results[i] = self.decodeSymbolsContainer(json)
+                except Exception as ex:
+                    errors.append(ex)
+                    return
+                if not self.quiet:
+                    print(msg)
+
+        workers = [ Thread(target=work) for x in range(min(threads, len(query_strings))) ]
+        for t in workers:
+            t.daemon = True
+            t.start()
+        for t in workers:
+            t.join()
+        if errors:
+            raise errors[0]
+        return results
+
+    def _decode(self, json):
+        # Can run in many threads at once, next to _apply_fetch
+        start = time()
+        (symbols, count) = self.decodeSymbolsContainer(json)
+        self.metrics.observe("decode_seconds", time() - start)
+        self.metrics.observe("symbols_per_request", len(symbols))
+
+        if(count > 10):
+            # This should never happen with this API, it always returns at most 10 items
+            raise Exception("Funny things are happening: count "
+                            + text(count) + " > 10. Content:\n"
+                            + repr(json))
+        return (symbols, count)
+
+    def _apply_fetch(self, current_query, decoded, msg):
+        # Must only ever run in one thread at a time, all engines share it
+        # so they build the same symbols and query tree
+        start = time()
+        (symbols, count) = decoded
+        _interrupts.applying = True
+        try:
+            if self.pruner is not None:
+                self.pruner.record(current_query, symbols)
+
+            narrow = self._needs_narrowing(count)
+            novel = 0
+            if narrow and self.queries.ranked or self.stats is not None:
+                # The frontier ranks the children by it, and ytd.QueryStats keeps it
+                novel = sum(1 for symbol in symbols if symbol.ticker not in self.symbols)
 
             for symbol in symbols:
-                self.symbols[symbol.ticker] = symbol
-                # record symbols returned for this query
-                current_query.results.append(symbol.ticker)
-
-            if(count > 10):
-                # This should never happen with this API, it always returns at most 10 items
-                raise Exception("Funny things are happening: count "
-                                + text(count) + " > 10. Content:\n"
-                                + repr(json))
-
-            # There is no pagination with this API.
-            # If we receive X results, we assume there are more than X and
-            #  add another layer of queries to narrow the search further
-            # In the past, X was known to be 10. Now it is some number 1 < X <= 10
-            if self.result_count_action[count] is None:
-                # the action for this number of results is unknown,
-                # so assume search narrowing is required
-                self._add_queries(current_query, general_search_characters)
-            elif self.result_count_action[count]:
-                # this number of results is known to require search narrowing
-                self._add_queries(current_query, general_search_characters)
-            else:
-                # Tell the query it's done
-                current_query.done()
+                # Most symbols are found again by many queries, and are unchanged
+                if symbol is not self._known_symbol(symbol.ticker):
+                    self.symbols[symbol.ticker] = symbol
+                    self.batch_symbols[symbol.ticker] = symbol
+
+            self._apply_result(current_query, [ symbol.ticker for symbol in symbols ], narrow, novel)
+            self.current_queries.remove(current_query)
+        finally:
+            _interrupts.applied()
 
+        if not self.quiet:
             print(msg)
             self.status_print(symbols)
-            self.completed_queries.append(current_query)
-            self.fetch_returns.task_done()
+        seconds = time() - start
+        self.metrics.observe("apply_seconds", seconds)
+        self.apply_seconds += seconds
+        self.apply_count += 1
+
+    def _needs_narrowing(self, count):
+        # There is no pagination with this API.
+        # If we receive X results, we assume there are more than X and
+        #  add another layer of queries to narrow the search further
+        # In the past, X was known to be 10. Now it is some number 1 < X <= 10
+        if self.result_count_action[count] is None:
+            # the action for this number of results is unknown,
+            # so assume search narrowing is required
+            return True
+        elif self.result_count_action[count]:
+            # this number of results is known to require search narrowing
+            return True
+        else:
+            return False
+
+    def _apply_result(self, current_query, tickers, narrow, novel):
+        # record symbols returned for this query
+        current_query.results = tuple(tickers)
+        if self.stats is not None:
+            self.stats.record(current_query, len(tickers), novel, narrow)
+        if narrow:
+            self._add_queries(current_query, general_search_characters, novel)
+        if current_query.num_children == 0:
+            # Not narrowed, or all children were pruned
+            # Tell the query it's done
+            current_query.done()
+            # Which may have completed some of its ancestors as well
+            query = current_query
+            while query is not None and query.is_done:
+                self.batch_done.append(query)
+                self._survey_query(query)
+                query = query.parent
+        self.completed_queries.append(current_query)
+        self.batch_results.append((current_query, tickers, narrow, novel))
+
+    def journal_record(self):
+        """Everything the last completed batch changed, see ytd.Journal"""
+        return {
+            'takes': self.batch_taken,
+            'results': [ (q.query_string, tickers, narrow, novel) for (q, tickers, narrow, novel) in self.batch_results ],
+            'symbols': self.batch_symbols,
+            'result_count_action': list(self.result_count_action),
+        }
+
+    def replay_batch(self, record):
+        """Redo a batch from journal_record() without fetching anything"""
+        self._start_batch()
+        results = record['results']
+        if 'takes' in record:
+            takes = record['takes']
+        else:
+            # Before batches were pipelined everything was taken first
+            takes = [ (query_string, 0) for query_string in record['taken'] ]
+        in_flight = dict((q.query_string, q) for q in self.current_queries)
+        t = 0
+        for i in range(len(results) + 1):
+            # The queries that were taken before the i-th result
+            while t < len(takes) and takes[t][1] <= i:
+                query = self._take()
+                if query.query_string != takes[t][0]:
+                    raise Exception("The journal does not match the saved downloader state")
+                in_flight[query.query_string] = query
+                t += 1
+            if i == len(results):
+                break
+            (query_string, tickers, narrow) = results[i][:3]
+            # Recorded before frontiers could rank by it
+            novel = results[i][3] if len(results[i]) > 3 else 0
+            if query_string not in in_flight:
+                raise Exception("The journal does not match the saved downloader state")
+            query = in_flight.pop(query_string)
+            self.current_queries.remove(query)
+            if self.pruner is not None:
+                # Unchanged symbols were stored by an earlier batch
+                self.pruner.record(query, [ record['symbols'][ticker] if ticker in record['symbols']
+                                            else self.symbols[ticker] for ticker in tickers ])
+            self._apply_result(query, tickers, narrow, novel)
+        self.symbols.update(record['symbols'])
+        self.result_count_action = record['result_count_action']
+        # Whatever is still in flight is sent again
+        self.resend = Deque(self.current_queries)
+        self.in_flight = 0
+        self.done = len(self.queries) == 0 and not self.current_queries
 
     def querySurvey(self):
         # return if all actions are known
@@ -249,7 +690,12 @@ class SymbolDownloader:
         #        self.descent_actions[i] = 0
         actions = [ 0 if a is None else a for a in self.result_count_action ]
         #print(actions)
-        self.descendQueries(self.master_query, actions)
+        for i in range(lsrca):
+            if not isinstance(actions[i], bool):
+                if self.survey_narrowing[i]:
+                    actions[i] = True
+                else:
+                    actions[i] += self.survey_same[i]
         print(actions)
         # looking for queries where children returned same number of results as the parent
         # if this occurred 200 times then that result number doesn't require narrowing
@@ -264,19 +710,29 @@ class SymbolDownloader:
                     self.result_count_action[j] = True
         #print(self.result_count_action)
 
-    def descendQueries(self, query, actions):
+    def _survey_query(self, query):
+        # Called once for every query that is done
         if query.num_children > 0:
             count = len(query.results)
-            child_count = len(query.children_results)
-            if query.is_done and not isinstance(actions[count], bool):
-                if child_count > count:
-                    # we have found a return count for which search narrowing is required
-                    actions[count] = True
-                elif child_count == count:
-                    # record a probable non-narrowing result
-                    actions[count] += 1;
-            for child in query.children:
-                self.descendQueries(child, actions)
+            child_count = query.children_count
+            if child_count > count:
+                # we have found a return count for which search narrowing is required
+                self.survey_narrowing[count] = True
+            elif child_count == count:
+                # record a probable non-narrowing result
+                self.survey_same[count] += 1
+
+    def descendQueries(self, query):
+        # Rebuilds the survey statistics from a whole tree
+        self.survey_narrowing = [ False ] * len(self.result_count_action)
+        self.survey_same = [ 0 ] * len(self.result_count_action)
+        # Not recursive, the tree can be deeper than the recursion limit
+        stack = [ query ]
+        while stack:
+            query = stack.pop()
+            if query.is_done:
+                self._survey_query(query)
+            stack.extend(query.children)
 
     def isDone(self):
         return self.done
@@ -287,6 +743,10 @@ class SymbolDownloader:
     def getRowHeader(self):
         return ["Ticker", "Name", "Exchange"]
 
+    def getRowFields(self):
+        # The Symbol attributes in the columns of getRowHeader()
+        return ["ticker", "name", "exchange"]
+
     def printProgress(self):
         if self.isDone():
             print("Progress: Done!")
@@ -297,4 +757,19 @@ class SymbolDownloader:
                   + "\n"
                   + str(len(self.symbols)) + " unique " + self.type + " entries collected so far."
                  )
+        if self.pruner is not None:
+            print(self.pruner.describe())
+        if self.stats is not None:
+            print(self.stats.describe())
+        if self.cache is not None:
+            print(self.cache.describe())
+        print(self.rate_controller.describe())
+        if self.connections.describe() is not None:
+            print(self.connections.describe())
+        if self.utilization is not None:
+            print("Workers: " + str(int(round(self.utilization * 100))) + "% busy, "
+                  + str(len(self.current_queries)) + " queries in flight, writer "
+                  + str(int(round(self.writer_utilization * 100))) + "% busy"
+                  + ("" if self.writer_capacity is None else
+                     " (at most " + str(int(self.writer_capacity)) + " results/s)"))
         print ("")
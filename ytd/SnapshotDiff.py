@@ -0,0 +1,101 @@
+import io
+import json
+import sqlite3
+
+from .compat import csv, text
+from .Journal import Journal
+from .SqliteStore import SqliteSymbols
+
+ADDED = "added"
+REMOVED = "removed"
+MODIFIED = "modified"
+
+def _export_objects(f, path):
+    # The objects of a .ndjson or .json export, a line at a time where they allow it
+    if path.endswith(".json"):
+        first = f.readline()
+        if first.strip() not in ("[", "[]", ""):
+            # Exports before they were streamed hold the whole array on one line
+            for row in json.loads(first + f.read()):
+                yield row
+            return
+    for line in f:
+        # Streamed .json exports hold one object per line between [ and ]
+        line = line.strip().rstrip(",")
+        if line and line not in ("[", "]", "[]"):
+            yield json.loads(line)
+
+def _export_rows(path, headers):
+    # One row of a .csv, .ndjson or .json export at a time
+    with io.open(path, encoding='utf-8') as f:
+        if path.endswith(".csv"):
+            for row in csv.DictReader(f):
+                yield [ row.get(header) for header in headers ]
+            return
+        try:
+            for row in _export_objects(f, path):
+                if not isinstance(row, dict):
+                    raise ValueError("it holds something else than symbol objects")
+                yield [ row.get(header) for header in headers ]
+        except (ValueError, TypeError) as ex:
+            raise ValueError("Can not compare with " + path + ", " + str(ex))
+
+def snapshot_rows(path, downloader_class):
+    """The rows of an earlier snapshot, in the columns of downloader_class's export
+
+    path is a .csv, .ndjson or .json export, or the .pickle or .sqlite
+    download state. Raises ValueError for anything else.
+    """
+    downloader = downloader_class()
+    if path.endswith(".pickle"):
+        Journal(path[:-len(".pickle")]).load(downloader)
+        return (symbol.getRow() for symbol in downloader.getCollectedSymbols())
+    if path.endswith(".sqlite"):
+        return (symbol.getRow() for symbol in SqliteSymbols(sqlite3.connect(path)).values())
+    if path.endswith((".csv", ".ndjson", ".json")):
+        return _export_rows(path, downloader.getRowHeader())
+    raise ValueError("Can not compare with " + path + ", it is not a .csv, .ndjson, .json, .pickle or .sqlite file")
+
+def _digest(row):
+    # An export writes None as an empty string, so they are the same
+    return hash(tuple(text(value) if value else None for value in row[1:]))
+
+class SnapshotDiff:
+    """The changes from one snapshot of the symbols to the next, by ticker
+
+    The old rows are read once into an index of ticker -> hash of the other
+    fields, which is all that is kept in memory. changes() then streams the
+    new rows past it once, so neither snapshot needs to be sorted or loaded.
+    """
+
+    def __init__(self, old_rows):
+        self.index = {}
+        self.width = 1
+        for row in old_rows:
+            self.index[row[0]] = _digest(row)
+            self.width = len(row)
+        self.counts = { ADDED: 0, REMOVED: 0, MODIFIED: 0 }
+        self.unchanged = 0
+
+    def changes(self, new_rows):
+        """(change, row) for every new row that is not in the old snapshot as it is,
+        then (REMOVED, row with only the ticker) for the old tickers that are gone
+
+        It takes the tickers it sees out of the index, so it only works once.
+        """
+        for row in new_rows:
+            digest = self.index.pop(row[0], None)
+            if digest is None:
+                change = ADDED
+            elif digest != _digest(row):
+                change = MODIFIED
+            else:
+                self.unchanged += 1
+                continue
+            self.counts[change] += 1
+            yield (change, row)
+
+        for ticker in sorted(self.index):
+            self.counts[REMOVED] += 1
+            yield (REMOVED, [ ticker ] + [ None ] * (self.width - 1))
+        self.index = {}
@@ -0,0 +1,430 @@
+import copy
+import pickle
+import sqlite3
+from collections import deque as Deque
+
+from .Query import Query
+from .Frontier import StagedFrontier, SpillFrontier, YieldFrontier
+
+schema = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value BLOB
+);
+CREATE TABLE IF NOT EXISTS symbols (
+    ticker TEXT PRIMARY KEY,
+    symbol BLOB
+);
+CREATE TABLE IF NOT EXISTS queries (
+    query_string TEXT PRIMARY KEY,
+    result_count INTEGER,
+    narrowed INTEGER,
+    done INTEGER,
+    children_count INTEGER,
+    novel INTEGER
+);
+CREATE TABLE IF NOT EXISTS results (
+    query_string TEXT,
+    ticker TEXT,
+    PRIMARY KEY (query_string, ticker)
+);
+CREATE TABLE IF NOT EXISTS frontier (
+    position INTEGER PRIMARY KEY,
+    query_string TEXT
+);
+CREATE INDEX IF NOT EXISTS frontier_query ON frontier (query_string);
+CREATE TABLE IF NOT EXISTS deferred (
+    position INTEGER PRIMARY KEY,
+    query_string TEXT
+);
+CREATE TABLE IF NOT EXISTS classes (
+    query_string TEXT PRIMARY KEY,
+    length INTEGER,
+    count INTEGER
+);
+"""
+
+def _dumps(value):
+    return sqlite3.Binary(pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL))
+
+def _prefix_range(prefix):
+    # Bounds for all query strings that extend prefix
+    return (prefix + u'\x00', prefix + u'\uffff')
+
+class SqliteSymbols:
+    """Stands in for SymbolDownloader.symbols, new symbols are buffered until the next commit"""
+
+    def __init__(self, db):
+        self.db = db
+        self.pending = {}
+        self.count = db.execute("SELECT COUNT(*) FROM symbols").fetchone()[0]
+
+    def _stored(self, ticker):
+        row = self.db.execute("SELECT symbol FROM symbols WHERE ticker = ?", (ticker,)).fetchone()
+        return None if row is None else pickle.loads(bytes(row[0]))
+
+    def __setitem__(self, ticker, symbol):
+        if ticker not in self:
+            self.count += 1
+        self.pending[ticker] = symbol
+
+    def __getitem__(self, ticker):
+        symbol = self.get(ticker)
+        if symbol is None:
+            raise KeyError(ticker)
+        return symbol
+
+    def get(self, ticker, default=None):
+        if ticker in self.pending:
+            return self.pending[ticker]
+        symbol = self._stored(ticker)
+        return default if symbol is None else symbol
+
+    def __contains__(self, ticker):
+        # Without unpickling the symbol
+        return ticker in self.pending or self.db.execute(
+            "SELECT 1 FROM symbols WHERE ticker = ?", (ticker,)).fetchone() is not None
+
+    def __len__(self):
+        return self.count
+
+    def update(self, symbols):
+        for ticker, symbol in symbols.items():
+            self[ticker] = symbol
+
+    def values(self):
+        self.flush()
+        for (symbol,) in self.db.execute("SELECT symbol FROM symbols ORDER BY ticker"):
+            yield pickle.loads(bytes(symbol))
+
+    def flush(self):
+        self.db.executemany("INSERT OR REPLACE INTO symbols (ticker, symbol) VALUES (?, ?)",
+                            [ (ticker, _dumps(symbol)) for ticker, symbol in self.pending.items() ])
+        self.pending = {}
+
+class CompletedQueries:
+    """Stands in for SymbolDownloader.completed_queries, only the count stays in memory"""
+
+    def __init__(self, count):
+        self.count = count
+
+    def append(self, query):
+        self.count += 1
+
+    def __len__(self):
+        return self.count
+
+class SqliteStore:
+    """Keeps a downloader's symbols, frontier and query results in a SQLite database
+
+    Checkpoints are transaction commits, so an interruption loses at most the
+    batch that was in progress. Only the part of the query tree that is still
+    being worked on stays in memory: completed subtrees are dropped once their
+    results are in the database.
+
+    Has the same load/append/compact interface as ytd.Journal.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.path = name + ".sqlite"
+        self.db = sqlite3.connect(self.path, check_same_thread=False)
+        self.db.executescript(schema)
+        if "novel" not in [ row[1] for row in self.db.execute("PRAGMA table_info(queries)") ]:
+            # Created before the yield frontier
+            self.db.execute("ALTER TABLE queries ADD COLUMN novel INTEGER")
+        self.attached = None
+        # How much of the downloader's current batch was already written
+        self.batch_results = None
+        self.written_results = 0
+        self.written_done = 0
+        # The pruner whose deferred queries and classes are in the database
+        self.pruner = None
+        self.written_deferred = 0
+
+    def _meta(self, key):
+        row = self.db.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return None if row is None else pickle.loads(bytes(row[0]))
+
+    def _set_meta(self, key, value):
+        self.db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, _dumps(value)))
+
+    def load(self, downloader):
+        """Restore downloader from the database
+
+        Raises IOError if the database holds no downloader yet.
+        """
+        result_count_action = self._meta('result_count_action')
+        if result_count_action is None:
+            raise IOError("No downloader stored in " + self.path)
+        downloader.result_count_action = result_count_action
+        downloader.done = self._meta('done')
+        # The queries that were in flight are in the frontier again
+        downloader.current_queries = []
+        downloader.resend = Deque()
+        downloader.in_flight = 0
+        downloader.symbols = SqliteSymbols(self.db)
+        downloader.completed_queries = CompletedQueries(
+            self.db.execute("SELECT COUNT(*) FROM queries").fetchone()[0])
+        downloader.pruner = self._meta('pruner')
+        if downloader.pruner is not None:
+            self._load_pruner(downloader.pruner)
+            downloader.pruner.rebuild(downloader.symbols.values())
+        downloader.stats = self._meta('stats')
+
+        window = self._meta('frontier_window') if self._meta('frontier') == 'spill' else None
+        spilled = 0
+        spilled_children = {}
+        if window is not None and not self._meta('stage1'):
+            # Only the queries that are taken first are created,
+            # the others only need their parents in the tree
+            spilled = max(0, self.db.execute("SELECT COUNT(*) FROM frontier").fetchone()[0] - window)
+            frontier = [ query_string for (query_string,) in self.db.execute(
+                "SELECT query_string FROM frontier ORDER BY position DESC LIMIT ?", (window,)) ][::-1]
+            for query_string in self._frontier(spilled):
+                spilled_children[query_string[:-1]] = spilled_children.get(query_string[:-1], 0) + 1
+        else:
+            frontier = list(self._frontier())
+        (downloader.master_query, pending, parents) = self._load_tree(frontier, spilled_children)
+        if not frontier:
+            # Everything is done
+            downloader.master_query.done()
+        if window is not None:
+            downloader.queries = SpillFrontier(self.name + ".frontier", window,
+                                               (pending[query_string] for query_string in frontier),
+                                               self._meta('stage1'))
+            downloader.queries.root = downloader.master_query
+            # The database has them all, older segments are not needed
+            downloader.queries.clear()
+            downloader.queries.write((parents[query_string[:-1]], query_string[-1])
+                                     for query_string in self._frontier(spilled))
+        elif self._meta('frontier') == 'yield':
+            downloader.queries = YieldFrontier()
+            for query_string in frontier:
+                query = pending[query_string]
+                row = self.db.execute("SELECT novel FROM queries WHERE query_string = ?",
+                                      (query.parent.query_string,)).fetchone()
+                downloader.queries.add(query.parent, [ query ], row[0] if row and row[0] is not None else 0,
+                                       downloader._guessed(query.parent))
+        else:
+            downloader.queries = StagedFrontier((pending[query_string] for query_string in frontier),
+                                                self._meta('stage1'))
+        self.survey(downloader)
+        self._attach(downloader)
+        return downloader
+
+    def _load_pruner(self, pruner):
+        if pruner.deferred or pruner.classes:
+            # Stored before they had tables, the next commit moves them there
+            return
+        pruner.deferred = [ query_string for (query_string,) in self.db.execute(
+            "SELECT query_string FROM deferred ORDER BY position") ]
+        pruner.classes = dict((query_string, (length, count)) for (query_string, length, count)
+                              in self.db.execute("SELECT query_string, length, count FROM classes"))
+        self.pruner = pruner
+        self.written_deferred = len(pruner.deferred)
+
+    def _write_pruner(self, pruner):
+        # Writes all of a pruner the database does not have yet
+        self.db.execute("DELETE FROM deferred")
+        self.db.execute("DELETE FROM classes")
+        self.db.executemany("INSERT INTO deferred (query_string) VALUES (?)",
+                            [ (query_string,) for query_string in pruner.deferred ])
+        self.db.executemany("INSERT INTO classes (query_string, length, count) VALUES (?, ?, ?)",
+                            [ (query_string, length, count)
+                              for (query_string, (length, count)) in pruner.classes.items() ])
+        self.pruner = pruner
+        self.written_deferred = len(pruner.deferred)
+
+    def _frontier(self, limit=-1):
+        # The query strings in the frontier, the one taken last first
+        return ( query_string for (query_string,) in self.db.execute(
+            "SELECT query_string FROM frontier ORDER BY position LIMIT ?", (limit,)) )
+
+    def _load_tree(self, frontier, spilled_children):
+        # Rebuilds the part of the tree that is not done: every ancestor of a
+        # pending query, with just enough of their done children to continue
+        # spilled_children counts the pending children per parent that are
+        # not created, the parents are returned by query string
+        pending_strings = set(frontier)
+        live = set()
+        pending_children = {}
+        for query_string in frontier:
+            for i in range(len(query_string)):
+                live.add(query_string[:i])
+            pending_children.setdefault(query_string[:-1], []).append(query_string)
+        for query_string in spilled_children:
+            for i in range(len(query_string) + 1):
+                live.add(query_string[:i])
+        pending = {}
+        parents = {}
+
+        def build(query_string, parent):
+            query = Query(query_string, parent)
+            query.results = tuple(self._tickers("SELECT ticker FROM results WHERE query_string = ?",
+                                                (query_string,)))
+            if query_string in pending_strings:
+                pending[query_string] = query
+                return query
+            (low, high) = _prefix_range(query_string)
+            children = set(c for (c,) in self.db.execute(
+                "SELECT query_string FROM queries WHERE query_string > ? AND query_string < ?"
+                " AND length(query_string) = ?", (low, high, len(query_string) + 1)))
+            children.update(pending_children.get(query_string, []))
+            subtree_results = set()
+            query.children = []
+            for child_string in sorted(children):
+                if child_string in live or child_string in pending_strings:
+                    query.children.append(build(child_string, query))
+                else:
+                    # A done child, only its results matter to this query
+                    child = Query(child_string, query)
+                    child.is_done = True
+                    query.children.append(child)
+                    query.num_complete += 1
+                    (low, high) = _prefix_range(child_string)
+                    subtree_results.update(self._tickers(
+                        "SELECT ticker FROM results WHERE query_string = ?"
+                        " OR (query_string > ? AND query_string < ?)", (child_string, low, high)))
+            query.num_children = len(query.children) + spilled_children.get(query_string, 0)
+            query.subtree_results = subtree_results or None
+            if query_string in spilled_children:
+                parents[query_string] = query
+            return query
+
+        return (build(u'', None), pending, parents)
+
+    def _tickers(self, sql, params):
+        return [ ticker for (ticker,) in self.db.execute(sql, params) ]
+
+    def _attach(self, downloader):
+        self.attached = downloader
+        self.batch_results = downloader.batch_results
+        # A restored downloader has nothing unwritten
+        self.written_results = len(downloader.batch_results)
+        self.written_done = len(downloader.batch_done)
+
+    def _import(self, downloader):
+        # Writes a downloader that was kept in memory so far
+        self.db.execute("DELETE FROM frontier")
+        for query in downloader.completed_queries:
+            self._write_query(query, query.results, query.num_children > 0, 0)
+            if query.is_done:
+                self._write_done(query)
+        for query in downloader.completed_queries:
+            if query.is_done:
+                self._forget_subtree(query)
+        # Queries in flight stay in the frontier until their result is written
+        self.db.executemany("INSERT INTO frontier (query_string) VALUES (?)",
+                            [ (q.query_string,) for q in downloader.current_queries ]
+                            + [ (q.query_string,) for q in downloader.queries ])
+        symbols = downloader.symbols
+        downloader.symbols = SqliteSymbols(self.db)
+        downloader.symbols.update(symbols)
+        downloader.completed_queries = CompletedQueries(len(downloader.completed_queries))
+        self._attach(downloader)
+
+    def _write_query(self, query, tickers, narrowed, novel):
+        query_string = query.query_string
+        self.db.execute("INSERT OR REPLACE INTO queries (query_string, result_count, narrowed, done, novel)"
+                        " VALUES (?, ?, ?, 0, ?)", (query_string, len(tickers), int(narrowed), novel))
+        self.db.executemany("INSERT OR IGNORE INTO results (query_string, ticker) VALUES (?, ?)",
+                            [ (query_string, ticker) for ticker in tickers ])
+
+    def _write_done(self, query):
+        self.db.execute("UPDATE queries SET done = 1, children_count = ? WHERE query_string = ?",
+                        (query.children_count, query.query_string))
+
+    def _write_batch(self, downloader):
+        # Writes what the downloader processed since the last call,
+        # inside the current transaction
+        if downloader.batch_results is not self.batch_results:
+            self.batch_results = downloader.batch_results
+            self.written_results = 0
+            self.written_done = 0
+        results = downloader.batch_results[self.written_results:]
+        done = downloader.batch_done[self.written_done:]
+        self.written_results += len(results)
+        self.written_done += len(done)
+
+        pruner = downloader.pruner
+        for (query, tickers, narrow, novel) in results:
+            self._write_query(query, tickers, narrow, novel)
+            self.db.execute("DELETE FROM frontier WHERE query_string = ?", (query.query_string,))
+            if pruner is not None:
+                self.db.execute("DELETE FROM classes WHERE query_string = ?", (query.query_string,))
+            if narrow:
+                # In the order a staged frontier takes them, a yield frontier ranks them on load
+                children = query.children if downloader.queries.stage1 else query.children[::-1]
+                self.db.executemany("INSERT INTO frontier (query_string) VALUES (?)",
+                                    [ (child.query_string,) for child in children ])
+                if pruner is not None:
+                    # Those fetched since are gone from classes already
+                    self.db.executemany("INSERT OR REPLACE INTO classes (query_string, length, count)"
+                                        " VALUES (?, ?, ?)",
+                                        [ (child.query_string,) + pruner.classes[child.query_string]
+                                          for child in children if child.query_string in pruner.classes ])
+        if pruner is not None:
+            self.db.executemany("INSERT INTO deferred (query_string) VALUES (?)",
+                                [ (query_string,) for query_string in pruner.deferred[self.written_deferred:] ])
+            self.written_deferred = len(pruner.deferred)
+        for query in done:
+            self._write_done(query)
+        for query in done:
+            self._forget_subtree(query)
+        downloader.symbols.flush()
+
+    def _forget_subtree(self, query):
+        # A done query's whole subtree is in the database now,
+        # and its results were already merged into its parent
+        query.children = ()
+        query.results = ()
+
+    def _commit(self, downloader):
+        if self.attached is not downloader:
+            self._import(downloader)
+        if downloader.pruner is not None and downloader.pruner is not self.pruner:
+            self._write_pruner(downloader.pruner)
+        self._write_batch(downloader)
+        self._set_meta('result_count_action', downloader.result_count_action)
+        self._set_meta('stage1', downloader.queries.stage1)
+        if isinstance(downloader.queries, YieldFrontier):
+            self._set_meta('frontier', 'yield')
+        elif isinstance(downloader.queries, SpillFrontier):
+            self._set_meta('frontier', 'spill')
+            self._set_meta('frontier_window', downloader.queries.window)
+        else:
+            self._set_meta('frontier', 'staged')
+        self._set_meta('done', downloader.done)
+        pruner = downloader.pruner
+        if pruner is not None:
+            # Its deferred queries and classes are in their tables
+            pruner = copy.copy(pruner)
+            (pruner.deferred, pruner.classes) = ([], {})
+        self._set_meta('pruner', pruner)
+        self._set_meta('stats', downloader.stats)
+        self.db.commit()
+
+    def append(self, downloader):
+        """Commit the batch the downloader just completed"""
+        self._commit(downloader)
+
+    def compact(self, downloader):
+        """Commit everything processed so far, the batch may still be in progress"""
+        self._commit(downloader)
+
+    def survey(self, downloader):
+        """Does what SymbolDownloader.descendQueries does, over the database"""
+        downloader.survey_narrowing = [ False ] * len(downloader.result_count_action)
+        downloader.survey_same = [ 0 ] * len(downloader.result_count_action)
+        for (count, narrowing, same) in self.db.execute(
+                "SELECT result_count, MAX(children_count > result_count), SUM(children_count = result_count)"
+                " FROM queries WHERE narrowed = 1 AND done = 1 GROUP BY result_count"):
+            downloader.survey_narrowing[count] = bool(narrowing)
+            downloader.survey_same[count] = same
+        # The master query has no row
+        if downloader.master_query.is_done:
+            downloader._survey_query(downloader.master_query)
+
+    def close(self):
+        self.db.close()
@@ -1,12 +1,26 @@
 from .compat import is_py3, text
 
-class Symbol:
+def _slots(cls):
+    return [ name for klass in reversed(cls.__mro__) for name in klass.__dict__.get('__slots__', ()) ]
+
+class Symbol(object):
     """Abstract class"""
+    # There are hundreds of thousands of them, no __dict__ for each
+    __slots__ = ('ticker', 'name', 'exchange')
+
     def __init__(self, ticker, name, exchange):
         self.ticker = ticker
         self.name = name # <--- may be "None"
         self.exchange = exchange # <--- may be "None" too for some reason
 
+    def __getstate__(self):
+        return dict((name, getattr(self, name)) for name in _slots(type(self)))
+
+    def __setstate__(self, state):
+        # Also the __dict__ of symbols pickled before there were slots
+        for name, value in state.items():
+            setattr(self, name, value)
+
     def getType(self):
         return "Undefined"
 
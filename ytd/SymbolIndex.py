@@ -0,0 +1,144 @@
+import json
+import mmap
+import os
+from collections import OrderedDict
+
+from .exporter.IndexExporter import MAGIC, ENTRY, OFFSET, index_key, exchange_key
+from .PrefixIndex import name_tokens
+
+class _Mapped:
+    # One version of the file, a lookup keeps using the one it started with
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            self.stat = _version(os.fstat(f.fileno()))
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.mm[:len(MAGIC)] != MAGIC:
+            raise ValueError(path + " is not a symbol index, export it with -f index")
+        (meta_offset,) = OFFSET.unpack_from(self.mm, len(MAGIC))
+        meta = json.loads(self.mm[meta_offset:].decode("utf-8"))
+        self.headers = meta["headers"]
+        # Of the ticker, name and exchange
+        self.columns = meta["columns"]
+        self.rows = meta["rows"]
+        self.row_offsets = meta["row_offsets"]
+        self.tables = meta["tables"]
+
+    def key(self, table, i):
+        (offset, length, row) = ENTRY.unpack_from(self.mm, self.tables[table][0] + i * ENTRY.size)
+        return (self.mm[offset:offset + length], row)
+
+    def lower(self, table, key):
+        # The first entry of table that is not smaller than key
+        (low, high) = (0, self.tables[table][1])
+        while low < high:
+            middle = (low + high) // 2
+            if self.key(table, middle)[0] < key:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def starting_with(self, table, prefix):
+        """The rows of the keys of table that start with prefix, in the order of the keys"""
+        for i in range(self.lower(table, prefix), self.tables[table][1]):
+            (key, row) = self.key(table, i)
+            if not key.startswith(prefix):
+                return
+            yield row
+
+    def values(self, i):
+        (start, end) = [ OFFSET.unpack_from(self.mm, self.row_offsets + j * OFFSET.size)[0] for j in (i, i + 1) ]
+        return json.loads(self.mm[start:end].decode("utf-8"))
+
+    def row(self, i):
+        return OrderedDict(zip(self.headers, self.values(i)))
+
+def _version(stat):
+    return (stat.st_ino, stat.st_mtime, stat.st_size)
+
+class SymbolIndex:
+    """Looks symbols up in a .index file written by ytd.exporter.IndexExporter
+
+    The file is mapped into memory, a lookup reads only the entries its
+    binary search visits and the rows it returns. Rows are dicts of the
+    export's headers. Case does not matter, and exchange narrows any lookup
+    down to one exchange.
+
+    reload() switches to a new export of the file. Lookups that are running
+    finish on the old one, which is unmapped once the last of them is done.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.mapped = _Mapped(path)
+
+    def reload(self):
+        """Maps the file again if it was replaced, True if it was"""
+        try:
+            if _version(os.stat(self.path)) == self.mapped.stat:
+                return False
+            self.mapped = _Mapped(self.path)
+        except (IOError, OSError, ValueError):
+            # In the middle of being replaced, or gone, the old one keeps being used
+            return False
+        return True
+
+    def __len__(self):
+        return self.mapped.rows
+
+    def get(self, ticker):
+        """The symbol with exactly this ticker, or None"""
+        mapped = self.mapped
+        key = index_key(ticker)
+        i = mapped.lower("ticker", key)
+        if i < mapped.tables["ticker"][1]:
+            (found, row) = mapped.key("ticker", i)
+            if found == key:
+                return mapped.row(row)
+        return None
+
+    def tickers(self, prefix, exchange=None, limit=100):
+        """The symbols whose tickers start with prefix, by ticker"""
+        mapped = self.mapped
+        if exchange:
+            rows = mapped.starting_with("exchange", exchange_key(exchange, prefix))
+        else:
+            rows = mapped.starting_with("ticker", index_key(prefix))
+        return self._rows(mapped, rows, limit)
+
+    def exchange(self, exchange, limit=100):
+        """The symbols of exchange, by ticker"""
+        return self.tickers(u"", exchange, limit)
+
+    def names(self, words, exchange=None, limit=100):
+        """The symbols with, for every one of words, a word in their name that starts with it"""
+        mapped = self.mapped
+        tokens = [ index_key(token) for token in name_tokens(words) ]
+        if not tokens:
+            return []
+        # The longest word has the fewest names to check for the others
+        tokens.sort(key=len, reverse=True)
+        found = []
+        seen = set()
+        for row in mapped.starting_with("name", tokens[0]):
+            if row in seen:
+                continue
+            seen.add(row)
+            values = mapped.values(row)
+            (name, symbol_exchange) = [ values[column] for column in mapped.columns[1:] ]
+            if exchange and index_key(symbol_exchange or u"") != index_key(exchange):
+                continue
+            name = [ index_key(token) for token in name_tokens(name) ]
+            if all(any(word.startswith(token) for word in name) for token in tokens[1:]):
+                found.append(OrderedDict(zip(mapped.headers, values)))
+                if len(found) >= limit:
+                    break
+        return found
+
+    def _rows(self, mapped, rows, limit):
+        found = []
+        for row in rows:
+            if len(found) >= limit:
+                break
+            found.append(mapped.row(row))
+        return found
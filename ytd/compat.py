@@ -1,16 +1,31 @@
 # -*- coding: utf-8 -*-
 
+import os
 import sys
 
 is_py3 = (sys.version_info[0] > 2)
 
 if is_py3:
     text = str
-    from urllib import robotparser
     import csv
     from urllib.parse import quote
+    from urllib.parse import urlencode
+    from urllib.parse import parse_qs
+    replace = os.replace
 else:
     text = unicode
-    import robotparser
     from backports import csv
     from urllib import quote
+    from urllib import urlencode
+    from urlparse import parse_qs
+    # Not atomic on Windows, where rename fails if the destination exists
+    def replace(src, dst):
+        if os.name == 'nt' and os.path.exists(dst):
+            os.remove(dst)
+        os.rename(src, dst)
+
+try:
+    # Much faster on the search responses, but optional
+    from orjson import loads as json_loads
+except ImportError:
+    from json import loads as json_loads
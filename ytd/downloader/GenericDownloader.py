@@ -1,29 +1,30 @@
-from ..SimpleSymbolDownloader import SymbolDownloader
+from ..SimpleSymbolDownloader import SymbolDownloader, first_search_characters
 from ..symbols.Generic import Generic
 
 from ..compat import text
 
 class GenericDownloader(SymbolDownloader):
-    def __init__(self):
-        SymbolDownloader.__init__(self, "generic")
+    def __init__(self, prefixes=first_search_characters):
+        SymbolDownloader.__init__(self, "generic", prefixes)
 
     def decodeSymbolsContainer(self, json):
         symbols = []
-        count = 0
+        items = json['data']['items']
 
-        for row in json['data']['items']:
+        for row in items:
             ticker = text(row['symbol'])
-            name = row['name']
-            exchange = row['exch']
-            exchangeDisplay = row['exchDisp']
-            symbolType = row['type']
-            symbolTypeDisplay = row['typeDisp']
-            symbols.append(Generic(ticker, name, exchange, exchangeDisplay, symbolType, symbolTypeDisplay))
+            symbol = self._known_symbol(ticker)
+            if (symbol is None or symbol.name != row['name'] or symbol.exchange != row['exch']
+                    or symbol.exchangeDisplay != row['exchDisp'] or symbol.symbolType != row['type']
+                    or symbol.symbolTypeDisplay != row['typeDisp']):
+                symbol = Generic(ticker, row['name'], row['exch'], row['exchDisp'], row['type'], row['typeDisp'])
+            symbols.append(symbol)
 
-        count = len(json['data']['items'])
-
-        return (symbols, count)
+        return (symbols, len(items))
 
     def getRowHeader(self):
         return SymbolDownloader.getRowHeader(self) + ["exchangeDisplay", "Type", "TypeDisplay"]
 
+    def getRowFields(self):
+        return SymbolDownloader.getRowFields(self) + ["exchangeDisplay", "symbolType", "symbolTypeDisplay"]
+
@@ -1 +1,43 @@
 # -*- coding: utf-8 -*-
+from .GenericDownloader import GenericDownloader
+
+# type -> SymbolDownloader subclass, see register()
+downloaders = {
+    "generic": GenericDownloader,
+}
+
+# Packages that add types list them under this entry point group, as
+# type = package.module:DownloaderClass
+entry_point_group = "ytd.downloaders"
+
+def register(type, downloader_class):
+    """Makes downloader_class available as type
+
+    A downloader class subclasses ytd.SimpleSymbolDownloader.SymbolDownloader
+    and can be made without arguments, shards of a crawl are started with
+    setPrefixes(). It brings its own decodeSymbolsContainer(),
+    getRowHeader() and getRowFields().
+    """
+    downloaders[type] = downloader_class
+
+def _load_entry_points():
+    try:
+        from importlib.metadata import entry_points
+    except ImportError:
+        # Python 2 and older Python 3 only know the types given to register()
+        return
+    found = entry_points()
+    if hasattr(found, "select"):
+        found = found.select(group=entry_point_group)
+    else:
+        found = found.get(entry_point_group, [])
+    for entry_point in found:
+        if entry_point.name not in downloaders:
+            downloaders[entry_point.name] = entry_point.load()
+
+def downloader_class(type):
+    """The downloader class of type, None if no package registered it"""
+    if type not in downloaders:
+        # Only looked up when needed, it reads the metadata of every package
+        _load_entry_points()
+    return downloaders.get(type)
@@ -0,0 +1,13 @@
+import pyarrow
+
+from .ParquetExporter import ParquetExporter
+
+class ArrowExporter(ParquetExporter):
+    """Writes the symbols as an Arrow IPC file, which can be memory mapped and read without copying"""
+
+    extension = ".arrow"
+
+    def _open_writer(self, path):
+        # Every batch only adds to the dictionaries, the file format allows that
+        return pyarrow.ipc.new_file(path, self.schema,
+                                    options=pyarrow.ipc.IpcWriteOptions(emit_dictionary_deltas=True))
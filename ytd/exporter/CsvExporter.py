@@ -0,0 +1,17 @@
+import io
+
+from ..compat import csv, text
+
+class CsvExporter:
+    """Writes rows to a .csv file as they come"""
+
+    def __init__(self, path, headers):
+        self.f = io.open(path, 'w', encoding='utf-8')
+        self.f.write(text.join(u',', headers) + u'\n')
+        self.writer = csv.writer(self.f)
+
+    def writeRow(self, row):
+        self.writer.writerow([ text(y) if not y is None else u"" for y in row ])
+
+    def close(self):
+        self.f.close()
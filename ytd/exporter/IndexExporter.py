@@ -0,0 +1,80 @@
+import json
+import struct
+
+from ..compat import replace, text
+from ..PrefixIndex import name_tokens
+
+MAGIC = b"YTDINDEX"
+# Every key of a table: offset and length of the key, and the row it is of
+ENTRY = struct.Struct("<QII")
+OFFSET = struct.Struct("<Q")
+
+def index_key(value):
+    """How a ticker, name word or exchange is looked up, case does not matter"""
+    return text(value).upper().encode("utf-8")
+
+def exchange_key(exchange, ticker=u""):
+    # Sorted by exchange and then ticker, so one table answers both
+    return index_key(exchange) + b"\0" + index_key(ticker)
+
+class IndexExporter:
+    """Writes a .index file for ytd.SymbolIndex to look symbols up in
+
+    It holds every row as a line of JSON, and sorted tables of the
+    tickers, the words of the names and the exchanges followed by the
+    tickers, each pointing at the rows. A reader maps the file into memory
+    and binary searches the tables, nothing has to be loaded.
+
+    The rows are written as they come, only the keys are kept until close()
+    sorts them. The file is written next to path and then replaces it, so
+    whoever has the old one open keeps reading it.
+    """
+
+    def __init__(self, path, headers):
+        self.path = path
+        self.headers = list(headers)
+        self.columns = [ self.headers.index(header) if header in self.headers else i
+                         for (i, header) in enumerate(["Ticker", "Name", "Exchange"]) ]
+        self.f = open(path + ".tmp", "wb")
+        self.f.write(MAGIC + OFFSET.pack(0))
+        self.row_offsets = []
+        self.tables = { "ticker": [], "name": [], "exchange": [] }
+
+    def writeRow(self, row):
+        row_number = len(self.row_offsets)
+        self.row_offsets.append(self.f.tell())
+        self.f.write(json.dumps(row, ensure_ascii=False).encode("utf-8") + b"\n")
+
+        (ticker, name, exchange) = [ row[column] for column in self.columns ]
+        # The row number sorts after the key, so equal keys keep the order of the rows
+        suffix = struct.pack(">I", row_number)
+        self.tables["ticker"].append(index_key(ticker) + b"\0" + suffix)
+        for token in set(name_tokens(name)):
+            self.tables["name"].append(index_key(token) + b"\0" + suffix)
+        if exchange:
+            self.tables["exchange"].append(exchange_key(exchange, ticker) + b"\0" + suffix)
+
+    def close(self):
+        meta = { "headers": self.headers, "columns": self.columns, "rows": len(self.row_offsets), "tables": {} }
+        self.row_offsets.append(self.f.tell())
+        meta["row_offsets"] = self.f.tell()
+        for offset in self.row_offsets:
+            self.f.write(OFFSET.pack(offset))
+
+        for (name, keys) in self.tables.items():
+            keys.sort()
+            key_offsets = []
+            for key in keys:
+                key_offsets.append(self.f.tell())
+                self.f.write(key[:-5])
+            meta["tables"][name] = (self.f.tell(), len(keys))
+            for (key, offset) in zip(keys, key_offsets):
+                self.f.write(ENTRY.pack(offset, len(key) - 5, struct.unpack(">I", key[-4:])[0]))
+        self.tables = None
+
+        meta_offset = self.f.tell()
+        self.f.write(json.dumps(meta).encode("utf-8"))
+        self.f.seek(len(MAGIC))
+        self.f.write(OFFSET.pack(meta_offset))
+        self.f.close()
+        replace(self.path + ".tmp", self.path)
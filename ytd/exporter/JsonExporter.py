@@ -0,0 +1,16 @@
+from .NdjsonExporter import NdjsonExporter
+
+class JsonExporter(NdjsonExporter):
+    """Writes a JSON array of objects, one row at a time"""
+
+    def __init__(self, path, headers):
+        NdjsonExporter.__init__(self, path, headers)
+        self.separator = u'[\n'
+
+    def writeRow(self, row):
+        self.f.write(self.separator + self._encode(row))
+        self.separator = u',\n'
+
+    def close(self):
+        self.f.write(u'[]\n' if self.separator == u'[\n' else u'\n]\n')
+        self.f.close()
@@ -0,0 +1,21 @@
+import io
+import json
+from collections import OrderedDict
+
+from ..compat import text
+
+class NdjsonExporter:
+    """Writes one JSON object per line, so the file can be read back a row at a time"""
+
+    def __init__(self, path, headers):
+        self.f = io.open(path, 'w', encoding='utf-8')
+        self.headers = headers
+
+    def _encode(self, row):
+        return text(json.dumps(OrderedDict(zip(self.headers, row)), ensure_ascii=False))
+
+    def writeRow(self, row):
+        self.f.write(self._encode(row) + u'\n')
+
+    def close(self):
+        self.f.close()
@@ -0,0 +1,124 @@
+import os
+import shutil
+
+import pyarrow
+import pyarrow.parquet
+
+from ..compat import quote, replace, text
+
+# Too many distinct values to be worth a dictionary
+plain_fields = ("ticker", "name")
+
+# How pyarrow's hive partitioning names a partition without a value
+null_partition = "__HIVE_DEFAULT_PARTITION__"
+
+def _remove(path):
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    elif os.path.exists(path):
+        os.remove(path)
+
+class ParquetExporter:
+    """Writes the symbols as a .parquet file, or a directory of them per exchange
+
+    Rows are written in batches of batch_size. Every field except the ticker
+    and name is dictionary encoded. With partition_by, every value of that
+    field gets its own <path>/<field>=<value>/part-0.parquet, the way
+    pyarrow.dataset and other hive-style readers expect it, and the field
+    itself is left out of the files.
+
+    Everything is written to <path>.tmp first and swapped in by close(), so
+    a directory does not keep the partitions of an earlier export and a
+    file can become a directory or the other way around.
+    """
+
+    extension = ".parquet"
+
+    def __init__(self, path, fields, partition_by=None, batch_size=65536):
+        self.path = path
+        self.tmp_path = path + ".tmp"
+        self.fields = list(fields)
+        self.partition_by = partition_by
+        self.batch_size = batch_size
+        columns = [ field for field in self.fields if field != partition_by ]
+        self.schema = pyarrow.schema([
+            pyarrow.field(field, pyarrow.string() if field in plain_fields
+                          else pyarrow.dictionary(pyarrow.int32(), pyarrow.string()))
+            for field in columns ])
+        # partition value -> (writer, { field: buffered values })
+        self.partitions = {}
+        # field -> (values, value -> index), shared by all batches so
+        # every dictionary extends the previous one
+        self.dictionaries = dict((field, ([], {})) for field in columns if field not in plain_fields)
+        _remove(self.tmp_path)
+        if partition_by is not None:
+            os.makedirs(self.tmp_path)
+
+    def _open_writer(self, path):
+        return pyarrow.parquet.ParquetWriter(path, self.schema)
+
+    def _partition(self, value):
+        if value not in self.partitions:
+            if self.partition_by is None:
+                path = self.tmp_path
+            else:
+                directory = os.path.join(self.tmp_path, self.partition_by + "="
+                                         + (null_partition if value is None else quote(text(value), safe='')))
+                if not os.path.isdir(directory):
+                    os.makedirs(directory)
+                path = os.path.join(directory, "part-0" + self.extension)
+            self.partitions[value] = (self._open_writer(path),
+                                      dict((field.name, []) for field in self.schema))
+        return self.partitions[value]
+
+    def writeRow(self, row):
+        row = dict(zip(self.fields, row))
+        (writer, columns) = self._partition(row.get(self.partition_by))
+        for field, values in columns.items():
+            value = row[field]
+            values.append(None if value is None else text(value))
+        if len(columns[self.schema[0].name]) >= self.batch_size:
+            self._flush(writer, columns)
+
+    def _column(self, field, values):
+        if field not in self.dictionaries:
+            return pyarrow.array(values, type=pyarrow.string())
+        (dictionary, indices) = self.dictionaries[field]
+        codes = []
+        for value in values:
+            if value is None:
+                codes.append(None)
+                continue
+            if value not in indices:
+                indices[value] = len(dictionary)
+                dictionary.append(value)
+            codes.append(indices[value])
+        return pyarrow.DictionaryArray.from_arrays(pyarrow.array(codes, type=pyarrow.int32()),
+                                                   pyarrow.array(dictionary, type=pyarrow.string()))
+
+    def _flush(self, writer, columns):
+        if not columns[self.schema[0].name]:
+            return
+        batch = pyarrow.RecordBatch.from_arrays(
+            [ self._column(field.name, columns[field.name]) for field in self.schema ],
+            schema=self.schema)
+        writer.write_batch(batch)
+        for values in columns.values():
+            del values[:]
+
+    def close(self):
+        if not self.partitions and self.partition_by is None:
+            # Still write an empty file with the schema
+            self._partition(None)
+        for (writer, columns) in self.partitions.values():
+            self._flush(writer, columns)
+            writer.close()
+        if os.path.isdir(self.tmp_path) or os.path.isdir(self.path):
+            # A directory can not replace another one in one step
+            _remove(self.path + ".old")
+            if os.path.exists(self.path):
+                os.rename(self.path, self.path + ".old")
+            os.rename(self.tmp_path, self.path)
+            _remove(self.path + ".old")
+        else:
+            replace(self.tmp_path, self.path)
@@ -0,0 +1,82 @@
+import io
+import os
+import re
+import zipfile
+from xml.sax.saxutils import escape
+
+from ..compat import text
+
+content_types = u"""<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">
+<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>
+<Default Extension="xml" ContentType="application/xml"/>
+<Override PartName="/xl/workbook.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>
+<Override PartName="/xl/worksheets/sheet1.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>
+</Types>
+"""
+
+package_rels = u"""<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">
+<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="xl/workbook.xml"/>
+</Relationships>
+"""
+
+workbook = u"""<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">
+<sheets><sheet name="Symbols" sheetId="1" r:id="rId1"/></sheets>
+</workbook>
+"""
+
+workbook_rels = u"""<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">
+<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" Target="worksheets/sheet1.xml"/>
+</Relationships>
+"""
+
+sheet_start = u"""<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>
+"""
+
+sheet_end = u"""</sheetData></worksheet>
+"""
+
+# Characters that are not allowed in XML 1.0
+_invalid_xml = re.compile(u'[\x00-\x08\x0b\x0c\x0e-\x1f\ufffe\uffff]')
+
+class XlsxExporter:
+    """Writes an .xlsx file without holding the rows in memory
+
+    The worksheet is written to a temporary file as rows come in and
+    compressed into the .xlsx when it is closed.
+    """
+
+    def __init__(self, path, headers):
+        self.path = path
+        self.sheet_path = path + ".sheet.tmp"
+        self.sheet = io.open(self.sheet_path, 'w', encoding='utf-8')
+        self.sheet.write(sheet_start)
+        self.writeRow(headers)
+
+    def writeRow(self, row):
+        cells = []
+        for value in row:
+            if value is None:
+                cells.append(u'<c/>')
+            else:
+                cells.append(u'<c t="inlineStr"><is><t>' + escape(_invalid_xml.sub(u'', text(value)))
+                             + u'</t></is></c>')
+        self.sheet.write(u'<row>' + u''.join(cells) + u'</row>\n')
+
+    def close(self):
+        self.sheet.write(sheet_end)
+        self.sheet.close()
+        try:
+            with zipfile.ZipFile(self.path, 'w', zipfile.ZIP_DEFLATED) as f:
+                f.writestr('[Content_Types].xml', content_types.encode('utf-8'))
+                f.writestr('_rels/.rels', package_rels.encode('utf-8'))
+                f.writestr('xl/workbook.xml', workbook.encode('utf-8'))
+                f.writestr('xl/_rels/workbook.xml.rels', workbook_rels.encode('utf-8'))
+                # Compressed from the file in chunks
+                f.write(self.sheet_path, 'xl/worksheets/sheet1.xml')
+        finally:
+            os.remove(self.sheet_path)
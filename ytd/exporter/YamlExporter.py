@@ -0,0 +1,20 @@
+from .NdjsonExporter import NdjsonExporter
+
+class YamlExporter(NdjsonExporter):
+    """Writes a YAML list with one flow mapping per row
+
+    YAML is a superset of JSON, so every row is written as a JSON object.
+    """
+
+    def __init__(self, path, headers):
+        NdjsonExporter.__init__(self, path, headers)
+        self.empty = True
+
+    def writeRow(self, row):
+        self.f.write(u'- ' + self._encode(row) + u'\n')
+        self.empty = False
+
+    def close(self):
+        if self.empty:
+            self.f.write(u'[]\n')
+        self.f.close()
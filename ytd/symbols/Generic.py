@@ -1,6 +1,8 @@
 from ytd.Symbol import Symbol
 
 class Generic(Symbol):
+    __slots__ = ('exchangeDisplay', 'symbolType', 'symbolTypeDisplay')
+
     def __init__(self, ticker, name, exchange, exchangeDisplay, symbolType, symbolTypeDisplay):
         Symbol.__init__(self, ticker, name, exchange)
         self.exchangeDisplay = exchangeDisplay